@@ -1,47 +1,321 @@
-from reconstruction import reconstruct
-from minimization import minimize_reconstruction
+from reconstruction import Spectrum, reconstruct, reconstruct_exact, reconstruct_least_squares, reconstruct_rp_constants, reconstruct_crp_constants, rp_shifts, crp_shifts, spectrum_shifts
+from minimization import minimize_reconstruction, minimize_reconstruction_constants, reconstruct_and_minimize
+from statevector import StatevectorEngine
+from evaluation import EvaluationBudget
+from parameters import ParameterRegistry
+from ordering import AdaptiveOrdering
+from profiling import TimedCircuit, UpdateEvent
+import time
 import pennylane.numpy as np
 from numpy.typing import NDArray
 from pennylane import QNode
 from typing import Callable
 
 class CrotosolveOptimizer:
+    # evaluations needed to reconstruct one parameter, given the value at the current parameter
+    evaluations_per_parameter = {"RP": len(rp_shifts) - 1, "CRP": len(crp_shifts) - 1}
+
+    def __init__(
+            self,
+            batched: bool = False,
+            exact: bool = False,
+            groups: dict[str, list[list[tuple]]] = None,
+            shifts: dict[str, NDArray[np.float_]] = None,
+            spectra: dict[tuple[str, tuple], Spectrum] = None,
+            ordering: AdaptiveOrdering = None,
+            callback: Callable[[UpdateEvent], None] = None,
+    ) -> None:
+        """
+        If `batched` is set, the shifted evaluations of each reconstruction are
+        done in a single broadcasted circuit execution. This requires the
+        circuit to support parameter broadcasting along a trailing axis of its
+        parameter arrays, which all circuits in `circuits.py` do.
+
+        If `exact` is set, the circuit must be a `StatevectorEngine` and the
+        reconstructions are computed from the exact Fourier coefficients of the
+        gate environments instead of sampled evaluations.
+
+        If `groups` are given (see `structure.block_groups`), each group of
+        parameters is reconstructed from one broadcasted circuit execution and
+        updated at once (one by one for a `StatevectorEngine`). Groups must be
+        separable, so that this gives the same result as updating their
+        parameters one by one. Parameters that are in no group are skipped.
+
+        If `shifts` are given per gate type (see
+        `reconstruction.least_squares_shifts`), each parameter is reconstructed
+        by a least-squares fit to samples at these offsets from its current
+        value instead of interpolating the minimal set of samples. This is
+        meant for noisy (finite-shot) circuits, where no sample is reused.
+
+        If `spectra` are given per (gate, param_index) (see
+        `structure.parameter_spectra`), the parameters are reconstructed from
+        their spectra with `reconstruction.reconstruct_spectrum` instead of the
+        hand-derived reconstructions of their gate type, which is needed for
+        parameters that are shared by several gates or for other gates.
+
+        If an `ordering` (see `ordering.py`) is given, each sweep visits the
+        parameters it selects, in its order, and reports every update to it.
+        `last_updates` lists the (gate, param_index) pairs a sweep updated.
+
+        A `callback` is called with an `UpdateEvent` (see `profiling.py`) after
+        every parameter update. Its wall time is split into the circuit
+        evaluations, the reconstruction and the minimization. With a
+        `StatevectorEngine`, the simulation is part of the reconstruction.
+        Members of a group share the time of the group evenly, and its joint
+        minimization counts as reconstruction.
+        """
+        if shifts is not None and (groups is not None or exact):
+            raise ValueError("least-squares reconstruction cannot be combined with groups or exact reconstruction")
+        if spectra is not None and (shifts is not None or exact or any(len(group) > 1 for gate_groups in (groups or {}).values() for group in gate_groups)):
+            raise ValueError("spectrum reconstruction cannot be combined with least-squares or exact reconstruction or groups")
+        self.batched = batched
+        self.exact = exact
+        self.groups = groups
+        self.shifts = shifts
+        self.spectra = spectra
+        if ordering is not None and groups is not None:
+            raise ValueError("adaptive ordering cannot be combined with groups")
+        self.ordering = ordering
+        self.last_updates: list[tuple[str, tuple]] = []
+        self.callback = callback
+        self.sweeps = 0
+        if shifts is not None:
+            self.evaluations_per_parameter = {gate: len(gate_shifts) for gate, gate_shifts in shifts.items()}
+
+    def evaluations_for(self, gate: str, param_index: tuple) -> int:
+        """
+        Evaluations needed to reconstruct one parameter, given the value at the current parameter.
+        """
+        if self.spectra is not None:
+            return len(spectrum_shifts(self.spectra[(gate, param_index)])) - 1
+        return self.evaluations_per_parameter[gate]
+
     def step_and_cost(self, circuit, initial_rp_params: NDArray[np.float_], initial_crp_params: NDArray[np.float_], updates_dataset: list[float] = [], debug=False, full_output=False):
         """
         reconstruct and optimize the univariate cost functions independently
+
+        `circuit` may also be a `StatevectorEngine`, which evaluates the
+        univariate functions from cached gate environments.
+
+        If `circuit` is an `EvaluationBudget`, the sweep stops before the
+        first parameter whose reconstruction does not fit into the remaining
+        budget. The parameters after it keep their values and the cost output
+        only covers the updated parameters.
         """
+        budget = circuit if isinstance(circuit, EvaluationBudget) else None
+        if budget is not None:
+            circuit = budget.circuit
+        engine = circuit if isinstance(circuit, StatevectorEngine) else None
 
-        prev = circuit(initial_rp_params, initial_crp_params)
+        if engine is not None:
+            engine.load(initial_rp_params, initial_crp_params)
+
+        prev = (budget or circuit)(initial_rp_params, initial_crp_params)
         y_output = []
 
-        rp_params = initial_rp_params.copy()
-        crp_params = initial_crp_params.copy()
+        # univariates patch single parameters of the registry in place or only
+        # copy the varied array for broadcasting, see `_create_univariate`
+        registry = ParameterRegistry(np.shape(initial_rp_params), np.shape(initial_crp_params)).load(initial_rp_params, initial_crp_params)
+        rp_params, crp_params = registry.params
 
         # by caching the final value after each step, we can save #steps evaluations!
         cache = prev
+        exhausted = False
+
+        if self.ordering is not None:
+            visits = [(gate, [param_index]) for gate, param_index in self.ordering.order()]
+        elif self.groups is None:
+            visits = [(info.gate, [info.param_index]) for info in registry]
+        else:
+            visits = []
+            for gate in ["RP", "CRP"]:
+                if engine is not None:
+                    # the engine evaluates single parameters from cached environments, it gains nothing from groups
+                    groups = [[index] for group in self.groups[gate] for index in group]
+                else:
+                    groups = self.groups[gate]
+                visits.extend((gate, group) for group in groups)
+        self.last_updates = []
+        self.sweeps += 1
+
+        # QNode evaluations are counted by the budget wrapper, the others by hand
+        target = circuit if budget is None or engine is not None else budget
+        if self.callback is not None and engine is None:
+            target = TimedCircuit(target)
+
+        for gate, group in visits:
+            params = rp_params if gate == "RP" else crp_params
+            evaluations = self.evaluations_for(gate, group[0])
+            if budget is not None and not budget.allows(evaluations * len(group)):
+                # a prefix of a separable group is separable as well
+                group = group[:budget.remaining // evaluations]
+                exhausted = True
+                if len(group) == 0:
+                    if debug: print(f"Budget exhausted before {gate} parameter group")
+                    break
+            if debug: print(f"Optimizing {gate} parameters {group}...")
 
-        for params, gate in [(rp_params, "RP"), (crp_params, "CRP")]:
-            iterator = np.nditer(params, flags=['multi_index', 'zerosize_ok'])
-            for old_param_value in iterator:
-                param_index = iterator.multi_index
-                if debug: print(f"Optimizing {gate} parameter {param_index}...")
+            started = time.perf_counter()
+            evaluation_started = target.seconds if isinstance(target, TimedCircuit) else 0.0
+            if len(group) == 1:
+                param_index = group[0]
+                reconstruction, constants = self._reconstruct(target, rp_params, crp_params, param_index, gate, params[param_index], cache, registry)
+                reconstructed = time.perf_counter()
+                new_param_value, new_fun_value = minimize_reconstruction(reconstruction, constants, gate=gate)
+                new_param_values, new_fun_values = [new_param_value], [new_fun_value]
+                if self.ordering is not None:
+                    self.ordering.record(gate, param_index, constants, cache, new_fun_value)
+            else:
+                new_param_values, new_fun_values = self._update_group(target, rp_params, crp_params, group, gate, cache)
+                reconstructed = time.perf_counter()
+            minimized = time.perf_counter()
 
-                univariate = self._create_univariate(circuit, rp_params, crp_params, param_index, gate)
-                reconstruction, constants = reconstruct(univariate, theta=old_param_value, value_at_theta=cache, gate=gate)
-                new_param_value, new_fun_value = minimize_reconstruction(reconstruction, constants) # TODO gate!
+            if self.callback is not None:
+                evaluation_seconds = target.seconds - evaluation_started if isinstance(target, TimedCircuit) else 0.0
+                losses = [cache] + list(new_fun_values)
+                for member, param_index in enumerate(group):
+                    self.callback(UpdateEvent(
+                        gate,
+                        param_index,
+                        evaluations,
+                        losses[member],
+                        losses[member + 1],
+                        evaluation_seconds=evaluation_seconds / len(group),
+                        reconstruction_seconds=(reconstructed - started - evaluation_seconds) / len(group),
+                        minimization_seconds=(minimized - reconstructed) / len(group),
+                        sweep=self.sweeps,
+                    ))
+            if budget is not None and engine is not None:
+                budget.count(evaluations * len(group))
 
-                if debug: print(f"{gate} parameter update for {param_index} from {old_param_value} to {new_param_value} -> y = {new_fun_value}")
+            for param_index, new_param_value, new_fun_value in zip(group, new_param_values, new_fun_values):
+                if debug: print(f"{gate} parameter update for {param_index} from {params[param_index]} to {new_param_value} -> y = {new_fun_value}")
                 params[param_index] = new_param_value
+                if engine is not None:
+                    engine.update(gate, param_index, new_param_value)
                 updates_dataset.append(new_fun_value)
                 y_output.append(new_fun_value)
+                self.last_updates.append((gate, param_index))
 
                 cache = new_fun_value
 
+            if exhausted:
+                break
+
         if full_output:
             return (rp_params, crp_params), prev, y_output
         
         return (rp_params, crp_params), prev
 
+    def step_and_cost_multistart(self, circuit: QNode, initial_rp_params: NDArray[np.float_], initial_crp_params: NDArray[np.float_]):
+        """
+        One Crotosolve sweep for many starting points in lockstep. The parameter
+        arrays carry the starts along a trailing batch axis, i.e. they have the
+        shapes (*rp_shape, #starts) and (*crp_shape, #starts).
+        Each parameter is reconstructed for all starts with one broadcasted
+        circuit execution and the reconstructions are minimized vectorized.
+        Returns the new parameters, the costs before the sweep (#starts,) and
+        the costs after every update (#parameters, #starts).
+        """
+        rp_params = np.array(initial_rp_params, dtype=float, requires_grad=False)
+        crp_params = np.array(initial_crp_params, dtype=float, requires_grad=False)
+        num_starts = rp_params.shape[-1]
+
+        prev = np.reshape(circuit(rp_params, crp_params), num_starts)
+        cache = prev
+        y_output = []
+
+        for params, gate, shifts in [(rp_params, "RP", rp_shifts), (crp_params, "CRP", crp_shifts)]:
+            for param_index in np.ndindex(params.shape[:-1]):
+                thetas = params[param_index]
+
+                # all shifted parameter sets of a start are consecutive in the batch
+                shifted_params = np.repeat(params, len(shifts) - 1, axis=-1)
+                shifted_params[param_index] = (thetas[:, np.newaxis] + shifts[np.newaxis, 1:]).reshape(-1)
+                if gate == "RP":
+                    samples = circuit(shifted_params, np.repeat(crp_params, len(shifts) - 1, axis=-1))
+                else:
+                    samples = circuit(np.repeat(rp_params, len(shifts) - 1, axis=-1), shifted_params)
+                samples = np.concatenate([cache[:, np.newaxis], np.reshape(samples, (num_starts, -1))], axis=1)
+
+                _, new_param_values, new_fun_values = reconstruct_and_minimize(samples, thetas, gate)
+
+                params[param_index] = new_param_values
+                y_output.append(new_fun_values)
+                cache = new_fun_values
+
+        return (rp_params, crp_params), prev, np.array(y_output).reshape(-1, num_starts)
+
+    def _update_group(
+        self,
+        circuit: QNode,
+        rp_params: NDArray[np.float_],
+        crp_params: NDArray[np.float_],
+        group: list[tuple],
+        gate: str,
+        value_at_params: float,
+    ) -> tuple[list[float], list[float]]:
+        """
+        Reconstructs and minimizes all parameters of a separable group with the
+        others fixed to their current values. Returns the new parameter values
+        and the cost after applying the updates one after the other.
+        """
+        params = rp_params if gate == "RP" else crp_params
+        thetas = np.array([params[param_index] for param_index in group], dtype=float, requires_grad=False)
+
+        shifts = rp_shifts if gate == "RP" else crp_shifts
+        num_shifts = len(shifts) - 1
+
+        # all shifted parameter sets of a group member are consecutive in the batch
+        shifted_params = np.repeat(np.array(params, requires_grad=False)[..., np.newaxis], len(group) * num_shifts, axis=-1)
+        for member, (param_index, theta) in enumerate(zip(group, thetas)):
+            shifted_params[param_index + (slice(member * num_shifts, (member + 1) * num_shifts),)] = theta + shifts[1:]
+        if gate == "RP":
+            samples = circuit(shifted_params, crp_params)
+        else:
+            samples = circuit(rp_params, shifted_params)
+        samples = np.concatenate([
+            np.full((len(group), 1), float(value_at_params)),
+            np.reshape(samples, (len(group), num_shifts)),
+        ], axis=1)
+
+        reconstruct_constants = reconstruct_rp_constants if gate == "RP" else reconstruct_crp_constants
+        xs, ys = minimize_reconstruction_constants(
+            reconstruct_constants(samples, thetas),
+            gate,
+            points_x=thetas[:, np.newaxis] + shifts[np.newaxis, :],
+            points_y=samples,
+        )
+
+        # the cost is separable in the group, so the improvements add up
+        return list(xs), list(value_at_params + np.cumsum(ys - value_at_params))
+
+    def _reconstruct(
+        self,
+        circuit: QNode,
+        rp_params: NDArray[np.float_],
+        crp_params: NDArray[np.float_],
+        param_index: tuple,
+        gate: str,
+        theta: float,
+        value_at_theta: float,
+        registry: ParameterRegistry = None,
+    ):
+        if self.exact:
+            if not isinstance(circuit, StatevectorEngine):
+                raise ValueError("exact reconstruction needs a StatevectorEngine")
+            if circuit.supports_coefficients(gate, param_index):
+                coefficients = circuit.fourier_coefficients(gate, param_index)
+                return reconstruct_exact(coefficients, theta=theta, value_at_theta=value_at_theta, gate=gate)
+
+        univariate = self._create_univariate(circuit, rp_params, crp_params, param_index, gate, self.batched, registry)
+        if self.spectra is not None:
+            spectrum = self.spectra[(gate, param_index)]
+            return reconstruct(univariate, theta=theta, value_at_theta=value_at_theta, batched=self.batched, spectrum=spectrum)
+        if self.shifts is not None:
+            return reconstruct_least_squares(univariate, theta=theta, shifts=self.shifts[gate], gate=gate, batched=self.batched)
+        return reconstruct(univariate, theta=theta, value_at_theta=value_at_theta, gate=gate, batched=self.batched)
+
     @staticmethod
     def _create_univariate(
         circuit: QNode,
@@ -49,7 +323,36 @@ class CrotosolveOptimizer:
         crp_params: NDArray[np.float_],
         param_index: tuple,
         gate: str,
+        batched: bool = False,
+        registry: ParameterRegistry = None,
     ) -> Callable:
+        """
+        If the parameter arrays are the views of a `registry`, the univariate
+        patches the parameter in place for each evaluation instead of copying
+        the array. The circuit must then be done with the arrays when it
+        returns (which holds for QNodes and executors). Batched univariates
+        take their broadcasted arrays from the registry as well.
+        """
+        if isinstance(circuit, StatevectorEngine):
+            # the engine's univariates accept both single values and vectors
+            return circuit.univariate(gate, param_index)
+
+        if registry is not None and batched:
+            def univariate(param_values):
+                return circuit(*registry.broadcasted(gate, param_index, param_values))
+
+            return univariate
+
+        if registry is not None:
+            def univariate(param_value):
+                with registry.patched(gate, param_index, param_value) as params:
+                    return circuit(*params)
+
+            return univariate
+
+        if batched:
+            return CrotosolveOptimizer._create_batched_univariate(circuit, rp_params, crp_params, param_index, gate)
+
         if gate == "RP":
             def univariate(param_value):
                 updated_rp_params = rp_params.copy()
@@ -64,3 +367,33 @@ class CrotosolveOptimizer:
                 return circuit(rp_params, updated_crp_params)
             
             return univariate
+
+    @staticmethod
+    def _create_batched_univariate(
+        circuit: QNode,
+        rp_params: NDArray[np.float_],
+        crp_params: NDArray[np.float_],
+        param_index: tuple,
+        gate: str,
+    ) -> Callable:
+        """
+        Like `_create_univariate`, but the returned function takes a vector of
+        parameter values and evaluates all of them in one broadcasted execution.
+        The varied parameter array gets a trailing batch axis, so indexing like
+        `rp_params[layer, qubit]` inside the circuit yields a batch of angles.
+        """
+        def broadcast(params: NDArray[np.float_], param_values: NDArray[np.float_]) -> NDArray[np.float_]:
+            broadcasted_params = np.repeat(params[..., np.newaxis], len(param_values), axis=-1)
+            broadcasted_params[param_index] = param_values
+            return broadcasted_params
+
+        if gate == "RP":
+            def univariate(param_values):
+                return circuit(broadcast(rp_params, param_values), crp_params)
+
+            return univariate
+        else:
+            def univariate(param_values):
+                return circuit(rp_params, broadcast(crp_params, param_values))
+
+            return univariate
@@ -0,0 +1,139 @@
+"""
+Aggregation of loss curves over many instances.
+
+Loss curves are step functions over the number of circuit evaluations. They
+are resampled onto a shared integer evaluation grid and folded into running
+statistics one batch at a time, so the curves of a group never have to be held
+in memory together.
+"""
+import numpy as np
+from numpy.typing import NDArray
+from typing import Iterable
+
+def curve_arrays(result) -> tuple[NDArray[np.int64], NDArray[np.float_]]:
+    """
+    Returns the evaluations and loss values of a result as arrays. Also works
+    for results that only provide the list of `(evaluations, loss)` tuples.
+    """
+    if hasattr(result, "evaluations") and hasattr(result, "values"):
+        return np.asarray(result.evaluations), np.asarray(result.values, dtype=float)
+    loss = np.asarray(result.loss, dtype=float).reshape(-1, 2)
+    return loss[:, 0].astype(np.int64), loss[:, 1]
+
+def resample(evaluations: NDArray[np.int64], values: NDArray[np.float_], grid: NDArray[np.int64]) -> NDArray[np.float_]:
+    """
+    Evaluates a loss curve on `grid` by forward-filling: every grid point gets
+    the loss after the last update that used at most that many evaluations.
+    Points before the first entry get the first loss value, points after the
+    last entry (the optimizer converged) keep the final loss.
+    """
+    indices = np.searchsorted(evaluations, grid, side="right") - 1
+    return values[np.maximum(indices, 0)]
+
+class LossAggregator:
+    """
+    Streaming mean, standard deviation and quantiles of loss curves on a grid.
+
+    Mean and variance are merged batch by batch (Welford/Chan). Quantiles come
+    from a fixed-bin histogram per grid point over `value_range`, so they are
+    accurate to about one bin width.
+    """
+    def __init__(
+            self,
+            grid: NDArray[np.int64],
+            value_range: tuple[float, float] = (-1.0, 1.0),
+            bins: int = 400,
+    ) -> None:
+        self.grid = np.asarray(grid)
+        self.value_range = value_range
+        self.bins = bins
+        self.count = 0
+        self._mean = np.zeros(len(self.grid))
+        self._m2 = np.zeros(len(self.grid))
+        self._histogram = np.zeros((len(self.grid), bins), dtype=np.int64)
+
+    def add_curves(self, curves: NDArray[np.float_]) -> None:
+        """
+        Adds a batch of curves that were already resampled onto the grid, shape (n, len(grid)).
+        """
+        curves = np.atleast_2d(curves)
+        n = curves.shape[0]
+        if n == 0:
+            return
+
+        batch_mean = curves.mean(axis=0)
+        batch_m2 = ((curves - batch_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = batch_mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+        low, high = self.value_range
+        bin_index = np.clip(((curves - low) / (high - low) * self.bins).astype(np.int64), 0, self.bins - 1)
+        flat = (np.arange(len(self.grid)) * self.bins + bin_index).reshape(-1)
+        self._histogram += np.bincount(flat, minlength=self._histogram.size).reshape(self._histogram.shape)
+
+    def add(self, results: Iterable, batch_size: int = 256) -> None:
+        """
+        Resamples and adds results (anything `curve_arrays` accepts) in batches of `batch_size`.
+        """
+        batch = []
+        for result in results:
+            batch.append(resample(*curve_arrays(result), self.grid))
+            if len(batch) == batch_size:
+                self.add_curves(np.array(batch))
+                batch = []
+        if batch:
+            self.add_curves(np.array(batch))
+
+    @property
+    def mean(self) -> NDArray[np.float_]:
+        return self._mean.copy()
+
+    @property
+    def std(self) -> NDArray[np.float_]:
+        """
+        Sample standard deviation (like `statistics.stdev`), NaN for fewer than two curves.
+        """
+        if self.count < 2:
+            return np.full(len(self.grid), np.nan)
+        return np.sqrt(self._m2 / (self.count - 1))
+
+    def quantile(self, q: float) -> NDArray[np.float_]:
+        """
+        The `q`-quantile per grid point, interpolated linearly within a histogram bin.
+        """
+        assert self.count > 0, "no curves added"
+        low, high = self.value_range
+        width = (high - low) / self.bins
+        cumulative = np.cumsum(self._histogram, axis=1)
+        target = q * self.count
+        bin_index = np.minimum((cumulative < target).sum(axis=1), self.bins - 1)
+        rows = np.arange(len(self.grid))
+        before = np.where(bin_index > 0, cumulative[rows, np.maximum(bin_index - 1, 0)], 0)
+        in_bin = self._histogram[rows, bin_index]
+        fraction = np.where(in_bin > 0, (target - before) / np.maximum(in_bin, 1), 0.0)
+        return low + (bin_index + np.clip(fraction, 0.0, 1.0)) * width
+
+def aggregate(
+        results: Iterable,
+        max_evaluations: int,
+        quantiles: tuple[float, ...] = (0.25, 0.5, 0.75),
+        **kwargs,
+) -> dict[str, NDArray[np.float_]]:
+    """
+    Aggregates loss curves on the grid 0..max_evaluations and returns the grid,
+    mean, std and the requested quantiles (keyed like "q0.25").
+    """
+    aggregator = LossAggregator(np.arange(max_evaluations + 1), **kwargs)
+    aggregator.add(results)
+    aggregated = {
+        "evaluations": aggregator.grid,
+        "count": aggregator.count,
+        "mean": aggregator.mean,
+        "std": aggregator.std,
+    }
+    for q in quantiles:
+        aggregated[f"q{q}"] = aggregator.quantile(q)
+    return aggregated
@@ -0,0 +1,191 @@
+"""
+Consolidated, columnar storage for datasets.
+
+An archive is a folder with a small JSON index of the task metadata and a few
+flat binary arrays that hold the initial parameters and all loss curves back
+to back. The arrays are opened memory-mapped, so opening an archive neither
+reads the loss curves nor needs pennylane (unlike unpickling `.instance` files,
+which rebuilds a QNode per task).
+"""
+import json
+import os
+import shutil
+import sys
+import numpy as np
+from numpy.typing import NDArray
+from typing import Iterable
+
+from dataset import Dataset, Instance
+from results import OptimizationResult
+
+archive_version = 2
+# version 1 archives have no shots, all their tasks are analytic
+supported_versions = (1, 2)
+
+class ArchivedTask:
+    """
+    Plain-data stand-in for an `OptimizationTask` read from an archive (without a circuit).
+    """
+    def __init__(
+            self,
+            circuit_id: str,
+            num_qubits: int,
+            num_layers: int,
+            initial_params: tuple[NDArray[np.float_], NDArray[np.float_]],
+            max_evaluations: int,
+            convergence_threshold: float,
+            shots: int = None,
+    ) -> None:
+        self.circuit_id = circuit_id
+        self.num_qubits = num_qubits
+        self.num_layers = num_layers
+        self.initial_params = initial_params
+        self.max_evaluations = max_evaluations
+        self.convergence_threshold = convergence_threshold
+        self.shots = shots
+
+class Archive:
+    def __init__(self, path: str) -> None:
+        with open(os.path.join(path, "index.json"), "r") as file:
+            self.index = json.load(file)
+        assert self.index["version"] in supported_versions, f"unsupported archive version {self.index['version']}"
+        self.index.setdefault("shots", [None] * len(self.index["uuid"]))
+
+        self.optimizers: list[str] = self.index["optimizers"]
+        self._optimizer_columns = {optimizer: column for column, optimizer in enumerate(self.optimizers)}
+        # plain ndarray views on the memory maps, slicing np.memmap objects is slow
+        self.params = np.asarray(np.load(os.path.join(path, "params.npy"), mmap_mode="r"))
+        self.params_offsets = np.load(os.path.join(path, "params_offsets.npy"))
+        self.curve_offsets = np.load(os.path.join(path, "curve_offsets.npy"))
+        self.evaluations = np.asarray(np.load(os.path.join(path, "evaluations.npy"), mmap_mode="r"))
+        self.loss = np.asarray(np.load(os.path.join(path, "loss.npy"), mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.index["uuid"])
+
+    def initial_params(self, i: int) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+        rp_shape, crp_shape = self.index["rp_shape"][i], self.index["crp_shape"][i]
+        start = self.params_offsets[i]
+        middle = start + int(np.prod(rp_shape))
+        return (
+            self.params[start:middle].reshape(rp_shape),
+            self.params[middle:self.params_offsets[i + 1]].reshape(crp_shape),
+        )
+
+    def loss_curve(self, i: int, optimizer: str) -> tuple[NDArray[np.int64], NDArray[np.float_]]:
+        """
+        Returns the evaluations and loss values of an optimizer's loss curve (empty if it was not run).
+        """
+        curve = i * len(self.optimizers) + self._optimizer_columns[optimizer]
+        start, end = self.curve_offsets[curve], self.curve_offsets[curve + 1]
+        return self.evaluations[start:end], self.loss[start:end]
+
+    def task(self, i: int) -> ArchivedTask:
+        return ArchivedTask(
+            circuit_id=self.index["circuit_id"][i],
+            num_qubits=self.index["num_qubits"][i],
+            num_layers=self.index["num_layers"][i],
+            initial_params=self.initial_params(i),
+            max_evaluations=self.index["max_evaluations"][i],
+            convergence_threshold=self.index["convergence_threshold"][i],
+            shots=self.index["shots"][i],
+        )
+
+    def instance(self, i: int) -> Instance:
+        results = {}
+        for optimizer in self.optimizers:
+            evaluations, values = self.loss_curve(i, optimizer)
+            if len(evaluations) > 0:
+                # views into the archive's arrays
+                results[optimizer] = OptimizationResult.from_arrays(evaluations, values)
+
+        return Instance(task=self.task(i), results=results, uuid=self.index["uuid"][i])
+
+    def instances(self) -> Iterable[Instance]:
+        for i in range(len(self)):
+            yield self.instance(i)
+
+def write_archive(instances: Iterable[Instance], path: str) -> None:
+    instances = list(instances)
+    optimizers = sorted({name for instance in instances for name in instance.results.keys()})
+
+    index = {
+        "version": archive_version,
+        "optimizers": optimizers,
+        "uuid": [],
+        "circuit_id": [],
+        "num_qubits": [],
+        "num_layers": [],
+        "max_evaluations": [],
+        "convergence_threshold": [],
+        "shots": [],
+        "rp_shape": [],
+        "crp_shape": [],
+    }
+    params, params_offsets = [], [0]
+    evaluations, loss, curve_offsets = [], [], [0]
+
+    for instance in instances:
+        task = instance.task
+        rp_params, crp_params = (np.asarray(p, dtype=float) for p in task.initial_params)
+        index["uuid"].append(str(instance.uuid))
+        index["circuit_id"].append(task.circuit_id)
+        index["num_qubits"].append(int(task.num_qubits))
+        index["num_layers"].append(int(task.num_layers))
+        index["max_evaluations"].append(int(task.max_evaluations))
+        index["convergence_threshold"].append(float(task.convergence_threshold))
+        # loss curves of finite-shot tasks count shots instead of evaluations
+        index["shots"].append(None if task.shots is None else int(task.shots))
+        index["rp_shape"].append(list(rp_params.shape))
+        index["crp_shape"].append(list(crp_params.shape))
+
+        params.extend([rp_params.reshape(-1), crp_params.reshape(-1)])
+        params_offsets.append(params_offsets[-1] + rp_params.size + crp_params.size)
+
+        for optimizer in optimizers:
+            result = instance.results.get(optimizer, OptimizationResult())
+            evaluations.append(np.asarray(result.evaluations, dtype=np.int64))
+            loss.append(np.asarray(result.values, dtype=float))
+            curve_offsets.append(curve_offsets[-1] + len(result))
+
+    # written to a sibling folder first and swapped in, so that an interrupted
+    # write cannot leave an existing archive with arrays that do not match its index
+    path = os.path.normpath(path)
+    temporary = path + ".tmp"
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+    np.save(os.path.join(temporary, "params.npy"), np.concatenate(params) if params else np.zeros(0))
+    np.save(os.path.join(temporary, "params_offsets.npy"), np.array(params_offsets, dtype=np.int64))
+    np.save(os.path.join(temporary, "curve_offsets.npy"), np.array(curve_offsets, dtype=np.int64))
+    np.save(os.path.join(temporary, "evaluations.npy"), np.concatenate(evaluations) if evaluations else np.zeros(0, dtype=np.int64))
+    np.save(os.path.join(temporary, "loss.npy"), np.concatenate(loss) if loss else np.zeros(0))
+    # the index goes last, so a half-written archive cannot be opened
+    with open(os.path.join(temporary, "index.json"), "w") as file:
+        json.dump(index, file)
+
+    # os.replace cannot replace a non-empty folder, so an existing archive is moved aside first
+    if os.path.exists(path):
+        old = path + ".old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.replace(path, old)
+        os.replace(temporary, path)
+        shutil.rmtree(old)
+    else:
+        os.replace(temporary, path)
+
+def convert(folder: str, path: str) -> None:
+    """
+    Converts a folder of `.instance` files into an archive.
+    """
+    dataset = Dataset({})
+    dataset.readall(folder)
+    write_archive(dataset.instances.values(), path)
+    print(f"Archived {len(dataset.instances)} instances from {folder} to {path}.")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python archive.py <instance folder> <archive folder>")
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
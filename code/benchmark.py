@@ -0,0 +1,181 @@
+"""
+Benchmarks of the simulator and the optimizers.
+
+For every circuit and size of a benchmark spec (see `sweeps/benchmark.json`),
+the following are timed separately:
+- `evaluation`: one circuit evaluation (seconds),
+- `batched_throughput`: evaluations per second of broadcasted executions,
+- `sweep`: one batched Crotosolve `step_and_cost` sweep (seconds),
+- `reconstruction`: reconstruction and minimization of one CRP parameter,
+  through the scalar functions and through the vectorized kernel (seconds),
+- `optimize/<optimizer>`: one full optimization run (seconds).
+Each timing is the median of the given number of repeats. The results are
+written as JSON and can be compared to the results of an earlier run.
+
+usage: python benchmark.py <benchmark spec> [--output FILE] [--compare FILE] [--tolerance 0.2]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import numpy
+import pennylane as qml
+import pennylane.numpy as np
+from math import pi
+from statistics import median
+from typing import Callable
+
+from CrotosolveOptimizer import CrotosolveOptimizer
+from circuits import cached_circuit, parameter_shapes, supports
+from minimization import minimize_reconstruction, reconstruct_and_minimize
+from evaluation import EvaluationCache
+from optimizers import OptimizationTask, optimizers
+from reconstruction import crp_shifts, reconstruct_crp
+
+# metrics where larger values are better, all others are durations
+higher_is_better = {"batched_throughput"}
+
+def _time(function: Callable, repeats: int) -> float:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return median(durations)
+
+def _univariate(d: numpy.ndarray) -> Callable:
+    return lambda x: d[0] + d[2] * numpy.cos(x / 2 + d[1]) + d[4] * numpy.cos(x + d[3])
+
+def _reconstruction_problem(num_params: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Random CRP cost functions (their constants d1..d5, shape (5, N)), angles and samples.
+    """
+    rng = numpy.random.default_rng(0)
+    constants = rng.normal(size=(5, num_params, 1))
+    thetas = rng.random(num_params) * 4 * pi
+    samples = _univariate(constants)(thetas[:, numpy.newaxis] + crp_shifts)
+    return constants[..., 0], thetas, samples
+
+def benchmark_structure(
+        circuit_id: str,
+        num_qubits: int,
+        num_layers: int,
+        optimizer_names: list[str],
+        repeats: int = 5,
+        batch_size: int = 32,
+        max_evaluations: int = 250,
+) -> dict[str, float]:
+    circuit = cached_circuit(circuit_id, num_qubits, num_layers)
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    rng = numpy.random.default_rng(0)
+    rp_params = np.array(rng.random(rp_shape) * 2 * pi)
+    crp_params = np.array(rng.random(crp_shape) * 4 * pi)
+    # the first call builds and caches the tape structure
+    circuit(rp_params, crp_params)
+
+    results = {}
+    results["evaluation"] = _time(lambda: circuit(rp_params, crp_params), repeats)
+
+    batched_rp_params = np.repeat(rp_params[..., np.newaxis], batch_size, axis=-1)
+    batched_rp_params += np.array(rng.random(batched_rp_params.shape))
+    results["batched_throughput"] = batch_size / _time(lambda: circuit(batched_rp_params, crp_params), repeats)
+
+    optimizer = CrotosolveOptimizer(batched=True)
+    results["sweep"] = _time(lambda: optimizer.step_and_cost(circuit, rp_params, crp_params, updates_dataset=[]), repeats)
+
+    constants, thetas, samples = _reconstruction_problem(1000)
+    def scalar_reconstructions():
+        for i in range(100):
+            minimize_reconstruction(*reconstruct_crp(_univariate(constants[:, i]), thetas[i], samples[i, 0]))
+    results["reconstruction/scalar"] = _time(scalar_reconstructions, repeats) / 100
+    results["reconstruction/kernel"] = _time(lambda: reconstruct_and_minimize(samples, thetas), repeats) / len(thetas)
+
+    task = OptimizationTask(circuit_id, num_qubits, num_layers, (rp_params, crp_params), max_evaluations=max_evaluations)
+    for name in optimizer_names:
+        # every run starts with an empty value cache, so that it does not depend on the runs before it
+        EvaluationCache.shared(task.circuit).clear()
+        # optimization runs are expensive, time them once
+        results[f"optimize/{name}"] = _time(lambda: dict(optimizers)[name](task), 1)
+
+    return results
+
+def environment() -> dict[str, str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": numpy.__version__,
+        "pennylane": qml.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+def run_benchmarks(spec: dict) -> dict:
+    """
+    Runs all benchmarks of a spec and returns them keyed by "<circuit>_<qubits>x<layers>".
+    Structures a circuit does not support (e.g. sim11 with other than 4 qubits) are skipped.
+    """
+    optimizer_names = spec.get("optimizers", ["Crotosolve", "Rotosolve"])
+    benchmarks = {}
+    for circuit_id in spec["circuits"]:
+        for num_qubits, num_layers in spec["sizes"]:
+            key = f"{circuit_id}_{num_qubits}x{num_layers}"
+            if not supports(circuit_id, num_qubits):
+                print(f"Skipping {key}: {circuit_id} does not support {num_qubits} qubits")
+                continue
+            benchmarks[key] = benchmark_structure(
+                circuit_id,
+                num_qubits,
+                num_layers,
+                optimizer_names,
+                repeats=spec.get("repeats", 5),
+                batch_size=spec.get("batch_size", 32),
+                max_evaluations=spec.get("max_evaluations", 250),
+            )
+            print(f"{time.asctime()} - {key}: " + ", ".join(f"{metric}={value:.3g}" for metric, value in benchmarks[key].items()))
+    return {"environment": environment(), "spec": spec, "benchmarks": benchmarks}
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.2) -> list[str]:
+    """
+    Returns a line for every metric that got worse than in `baseline` by more
+    than the relative `tolerance`. Metrics missing in either run are ignored.
+    """
+    regressions = []
+    for key, metrics in current["benchmarks"].items():
+        for metric, value in metrics.items():
+            old = baseline["benchmarks"].get(key, {}).get(metric)
+            if old is None or old == 0:
+                continue
+            # ratio > 1 means worse
+            ratio = old / value if metric in higher_is_better else value / old
+            if ratio > 1 + tolerance:
+                regressions.append(f"{key} {metric}: {old:.3g} -> {value:.3g} ({ratio:.2f}x worse)")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks circuit evaluation, reconstruction and the optimizers.")
+    parser.add_argument("spec", help="JSON benchmark spec, see sweeps/benchmark.json")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results (default: benchmark_results.json)")
+    parser.add_argument("--compare", default=None, help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown that counts as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    with open(args.spec, "r") as file:
+        spec = json.load(file)
+    results = run_benchmarks(spec)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -1,6 +1,7 @@
 import pennylane as qml
 import pennylane.numpy as np
 from numpy.typing import NDArray
+from functools import lru_cache
 
 default_num_layers = 5
 default_num_qubits = 4
@@ -8,8 +9,8 @@ default_qnode_kwargs = {
     "diff_method": "parameter-shift"
 }
 
-def default_device(num_qubits: int) -> qml.Device:
-    return qml.device("default.qubit", wires=num_qubits)
+def default_device(num_qubits: int, shots: int = None) -> qml.Device:
+    return qml.device("default.qubit", wires=num_qubits, shots=shots)
 
 def _R_layer(r_gate, rp_params: NDArray[np.float_], num_qubits: int):
     for qubit in range(num_qubits):
@@ -443,4 +444,54 @@ circuit_generators = {
     "sim17": sim_17,
     "sim18": sim_18,
     "sim19": sim_19
-}
\ No newline at end of file
+}
+
+def parameter_shapes(circuit_id: str, num_qubits: int, num_layers: int) -> tuple[tuple, tuple]:
+    """
+    Returns the shapes of the `rp_params` and `crp_params` arrays a circuit expects.
+    Circuits without controlled rotations take an empty `crp_params` array.
+    """
+    q, l = num_qubits, num_layers
+    return {
+        "sim01": ((l, q, 2), (0,)),
+        "sim02": ((l, q, 2), (0,)),
+        "sim03": ((l, q, 2), (l, q - 1)),
+        "sim04": ((l, q, 2), (l, q - 1)),
+        "sim05": ((l, q, 4), (l, q, q - 1)),
+        "sim06": ((l, q, 4), (l, q, q - 1)),
+        "sim07": ((l, q, 4), (l, q - 1)),
+        "sim08": ((l, q, 4), (l, q - 1)),
+        "sim09": ((l, q), (0,)),
+        "sim10": ((l + 1, q), (0,)),
+        "sim11": ((l, q, 3), (0,)),
+        "sim12": ((l, q, 3), (0,)),
+        "sim13": ((l, q, 2), (l, q, 2)),
+        "sim14": ((l, q, 2), (l, q, 2)),
+        "sim15": ((l, q, 2), (0,)),
+        "sim16": ((l, q, 2), (l, q - 1)),
+        "sim17": ((l, q, 2), (l, q - 1)),
+        "sim18": ((l, q, 2), (l, q)),
+        "sim19": ((l, q, 2), (l, q)),
+    }[circuit_id]
+
+
+# circuits that are only defined for one number of qubits
+fixed_num_qubits = {"sim11": 4, "sim12": 4}
+
+def supports(circuit_id: str, num_qubits: int) -> bool:
+    """
+    Whether a circuit can be built with `num_qubits` qubits.
+    """
+    return circuit_id in circuit_generators and fixed_num_qubits.get(circuit_id, num_qubits) == num_qubits
+
+@lru_cache(maxsize=None)
+def cached_circuit(circuit_id: str, num_qubits: int, num_layers: int, shots: int = None) -> qml.QNode:
+    """
+    Returns the QNode of a circuit structure, built once per process.
+    QNodes hold no parameters, so all tasks with the same structure can share one.
+    With `shots`, the expectation value is estimated from that many samples.
+    """
+    circuit = circuit_generators[circuit_id](num_qubits=num_qubits, num_layers=num_layers)
+    if shots is None:
+        return circuit
+    return qml.QNode(circuit.func, default_device(num_qubits, shots=shots), **default_qnode_kwargs)
@@ -1,11 +1,18 @@
-import pennylane.numpy as np
-from numpy.typing import NDArray
-from optimizers import OptimizationResult, OptimizationTask
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor
+import json
 import os
 import pickle
+import re
 from pathlib import Path
 from uuid import uuid4
 
+if TYPE_CHECKING:
+    # not imported at runtime, so that reading archives does not need pennylane
+    from optimizers import OptimizationTask
+    from results import OptimizationResult
+
 class Instance:
     def __init__(
             self,
@@ -19,7 +26,12 @@ class Instance:
     
     def save(self, folder: str) -> None:
         file = os.path.join(folder, f"{self.task.circuit_id}_{self.task.num_qubits}x{self.task.num_layers}_{self.uuid}.instance")
-        pickle.dump(self, open(file, "wb"))
+        # written to a temporary file first, so that an interrupted save cannot leave a truncated instance
+        with open(file + ".tmp", "wb") as handle:
+            pickle.dump(self, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(file + ".tmp", file)
     
     def valid(self) -> bool:
         # TODO: check contained data too!
@@ -29,21 +41,187 @@ class Instance:
             and self.uuid is not None
         )
 
+# {circuit_id}_{num_qubits}x{num_layers}_{uuid}.instance, see `Instance.save`
+instance_filename = re.compile(r"^(?P<circuit_id>[^_]+)_(?P<num_qubits>\d+)x(?P<num_layers>\d+)_(?P<uuid>.+)\.instance$")
+manifest_filename = ".manifest.json"
+manifest_version = 1
+
+# criteria that can be decided from the file name alone
+filename_fields = ("circuit_id", "num_qubits", "num_layers", "uuid")
+# criteria that need the task, cached in the manifest once read
+# (loss curves of tasks with shots count shots instead of evaluations)
+task_fields = ("max_evaluations", "convergence_threshold", "shots")
+
+# what unpickling a truncated, corrupted or outdated file can raise
+unpickling_errors = (EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError)
+
+def _read_instance(filepath: Path) -> Instance | None:
+    try:
+        with open(filepath, "rb") as file:
+            instance: Instance = pickle.load(file)
+    except unpickling_errors as error:
+        print(f"{type(error).__name__} reading {filepath.name}!")
+        return None
+
+    if isinstance(instance, Instance) and instance.valid():
+        return instance
+    print(f"Invalid instance {filepath.name}!")
+    return None
+
+def _read_task_fields(filepath: Path) -> dict | None:
+    """
+    Reads an instance and returns just the task fields, so that worker
+    processes only send a few numbers back.
+    """
+    instance = _read_instance(filepath)
+    if instance is None:
+        return None
+    return {field: getattr(instance.task, field) for field in task_fields}
+
+class LazyInstances(Mapping):
+    """
+    Mapping of uuid to instance that deserializes each instance file on first
+    access. Files that cannot be read are dropped from the mapping when they
+    are first accessed, so `items` and `values` skip them.
+    """
+    def __init__(self, filepaths: dict[str, Path]) -> None:
+        self.filepaths = filepaths
+        self.loaded: dict[str, Instance] = {}
+
+    def __getitem__(self, uuid: str) -> Instance:
+        if uuid not in self.loaded:
+            instance = _read_instance(self.filepaths[uuid])
+            if instance is None:
+                print(f"Dropping unreadable instance {uuid} ({self.filepaths[uuid]}).")
+                del self.filepaths[uuid]
+                raise KeyError(uuid)
+            self.loaded[uuid] = instance
+        return self.loaded[uuid]
+
+    def __iter__(self) -> Iterator[str]:
+        # over a copy, since unreadable files are dropped while iterating
+        return (uuid for uuid in list(self.filepaths) if uuid in self.filepaths)
+
+    def items(self) -> Iterator[tuple[str, Instance]]:
+        for uuid in self:
+            instance = self.get(uuid)
+            if instance is not None:
+                yield uuid, instance
+
+    def values(self) -> Iterator[Instance]:
+        return (instance for _, instance in self.items())
+
+    def __len__(self) -> int:
+        return len(self.filepaths)
+
+    def load(self) -> None:
+        """
+        Deserializes all instances that were not accessed yet. This runs in
+        the calling process: unpickling holds the GIL, and worker processes
+        would have to pickle the instances back, so neither threads nor
+        processes are faster.
+        """
+        for uuid in self:
+            self.get(uuid)
+
 class Dataset:
-    def __init__(self, instances: dict[str, Instance] = {}) -> None:
-        self.instances = instances
+    def __init__(self, instances: dict[str, Instance] = None) -> None:
+        self.instances = instances if instances is not None else {}
+        self.folder: str = None
+        self.manifest: dict[str, dict] = None
 
     def readall(self, folder: str) -> None:
         files = os.listdir(folder)
         for filename in files:
-            filepath = Path(folder, filename)
-            try:
-                instance: Instance = pickle.load(open(filepath, "rb"))
-            except EOFError:
-                print(f"EOFError reading {filename}!")
+            if not filename.endswith(".instance"):
+                continue
+            instance = _read_instance(Path(folder, filename))
+            if instance is not None:
+                self.instances[str(instance.uuid)] = instance
+
+    def scan(self, folder: str) -> None:
+        """
+        Indexes the instance files of `folder` by their file names without
+        deserializing them. The index is cached in the folder's manifest file,
+        together with task fields that `select` had to read before.
+        """
+        self.folder = folder
+        manifest_path = Path(folder, manifest_filename)
+        cached = {}
+        if manifest_path.exists():
+            with open(manifest_path, "r") as file:
+                content = json.load(file)
+            if content.get("version") == manifest_version:
+                cached = content["files"]
+
+        self.manifest = {}
+        for entry in os.scandir(folder):
+            match = instance_filename.match(entry.name)
+            if match is None:
+                continue
+            stat = entry.stat()
+            if entry.name in cached and (cached[entry.name]["size"], cached[entry.name]["mtime"]) == (stat.st_size, stat.st_mtime):
+                self.manifest[entry.name] = cached[entry.name]
                 continue
 
-            if isinstance(instance, Instance) and instance.valid():
-                self.instances[instance.uuid] = instance
-            else:
-                print(f"Invalid instance {filename}!")
+            self.manifest[entry.name] = {
+                "circuit_id": match["circuit_id"],
+                "num_qubits": int(match["num_qubits"]),
+                "num_layers": int(match["num_layers"]),
+                "uuid": match["uuid"],
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+
+        if self.manifest != cached:
+            self._save_manifest()
+
+    def select(self, workers: int = None, **criteria) -> Dataset:
+        """
+        Returns the instances of the scanned folder that match all criteria,
+        e.g. `dataset.select(circuit_id="sim05", max_evaluations=250, shots=None)`.
+        Only matching instances are deserialized, lazily on first access (or
+        all at once with `instances.load()`). Task fields that
+        are not in the manifest yet are read in `workers` parallel processes.
+        """
+        assert self.manifest is not None, "call scan(folder) before select"
+        unknown = set(criteria) - set(filename_fields) - set(task_fields)
+        assert not unknown, f"cannot select by {unknown}"
+
+        candidates = [
+            filename
+            for filename, entry in self.manifest.items()
+            if all(entry[field] == criteria[field] for field in filename_fields if field in criteria)
+        ]
+
+        needed = [field for field in task_fields if field in criteria]
+        missing = [filename for filename in candidates if any(field not in self.manifest[filename] for field in needed)]
+        if missing:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                filepaths = [Path(self.folder, filename) for filename in missing]
+                for filename, fields in zip(missing, executor.map(_read_task_fields, filepaths, chunksize=16)):
+                    if fields is not None:
+                        self.manifest[filename].update(fields)
+            self._save_manifest()
+
+        selected = {
+            self.manifest[filename]["uuid"]: Path(self.folder, filename)
+            for filename in candidates
+            if all(field in self.manifest[filename] and self.manifest[filename][field] == criteria[field] for field in needed)
+        }
+        dataset = Dataset(LazyInstances(selected))
+        dataset.folder = self.folder
+        return dataset
+
+    def _save_manifest(self) -> None:
+        with open(Path(self.folder, manifest_filename), "w") as file:
+            json.dump({"version": manifest_version, "files": self.manifest}, file)
+
+    def readarchive(self, path: str) -> None:
+        """
+        Reads all instances of an archive (see `archive.py`). Their parameters
+        and loss curves stay memory-mapped instead of being loaded.
+        """
+        from archive import Archive
+        for instance in Archive(path).instances():
+            self.instances[str(instance.uuid)] = instance
@@ -0,0 +1,129 @@
+import numpy as np
+import weakref
+from autograd.tracer import Box
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Callable
+
+class BudgetExhausted(Exception):
+    pass
+
+class EvaluationBudget:
+    """
+    Wraps a circuit and counts its evaluations against a budget. Broadcasted
+    executions count once per evaluated parameter set.
+
+    Calls that would exceed the budget raise `BudgetExhausted`, or, if a
+    `placeholder` is given, return it without running the circuit. The latter
+    is for optimizers that cannot be stopped in the middle of a step; their
+    updates after the budget ran out have to be discarded.
+    """
+    def __init__(self, circuit: Callable, max_evaluations: int, placeholder: float = None) -> None:
+        self.circuit = circuit
+        self.max_evaluations = max_evaluations
+        self.placeholder = placeholder
+        self.evaluations = 0
+        # lets inspect.signature see the circuit's argument names (RotosolveOptimizer refers to them)
+        self.__wrapped__ = circuit
+
+    @property
+    def remaining(self) -> int:
+        return self.max_evaluations - self.evaluations
+
+    def allows(self, evaluations: int) -> bool:
+        return evaluations <= self.remaining
+
+    def count(self, evaluations: int) -> None:
+        """
+        Counts evaluations that did not go through this wrapper (e.g. of a
+        `StatevectorEngine` univariate, or sampled evaluations that an exact
+        reconstruction stands in for).
+        """
+        self.evaluations += evaluations
+
+    def __call__(self, *params):
+        if self.remaining <= 0:
+            if self.placeholder is not None:
+                return self.placeholder
+            raise BudgetExhausted(f"all {self.max_evaluations} evaluations are used up")
+
+        value = self.circuit(*params)
+        self.evaluations += int(np.size(value))
+        return value
+
+class EvaluationCache:
+    """
+    LRU cache of circuit values keyed by a hash of the parameter buffers.
+
+    `simulations` counts the parameter sets that were actually simulated,
+    independently of the evaluations an `EvaluationBudget` around the cache
+    charges. Calls with autograd-traced parameters (gradient computations)
+    bypass the cache.
+    """
+    _shared: "weakref.WeakKeyDictionary[Callable, EvaluationCache]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, circuit: Callable, maxsize: int = 4096) -> None:
+        self.circuit = circuit
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.simulations = 0
+        self._values: OrderedDict[bytes, object] = OrderedDict()
+        # lets inspect.signature see the circuit's argument names (RotosolveOptimizer refers to them)
+        self.__wrapped__ = circuit
+
+    @classmethod
+    def shared(cls, circuit: Callable) -> "EvaluationCache":
+        """
+        The process-wide cache of `circuit`, so that all optimizers running on
+        tasks with the same (cached) QNode share their values.
+        """
+        if circuit not in cls._shared:
+            cls._shared[circuit] = cls(circuit)
+        return cls._shared[circuit]
+
+    @staticmethod
+    def _key(params: tuple) -> bytes:
+        digest = blake2b(digest_size=16)
+        for param in params:
+            param = np.asarray(param, dtype=float)
+            digest.update(repr(param.shape).encode())
+            digest.update(np.ascontiguousarray(param).tobytes())
+        return digest.digest()
+
+    def __call__(self, *params):
+        if any(isinstance(param, Box) for param in params):
+            value = self.circuit(*params)
+            self.simulations += int(np.size(value))
+            return value
+
+        key = self._key(params)
+        if key in self._values:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+
+        self.misses += 1
+        value = self.circuit(*params)
+        self.simulations += int(np.size(value))
+        self._values[key] = value
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        """
+        Drops all cached values, e.g. so that a timed run starts cold.
+        """
+        self._values.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "simulations": self.simulations,
+            "size": len(self._values),
+        }
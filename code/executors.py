@@ -0,0 +1,297 @@
+"""
+Asynchronous circuit execution.
+
+An executor evaluates the circuit of one structure for many parameter sets
+concurrently. It can stand in for the QNode wherever the optimizers call the
+circuit: broadcasted calls (a trailing batch axis on the parameter arrays, see
+`circuits.py`) are split into single parameter sets that are evaluated in
+parallel, e.g. the shifted evaluations of a Crotosolve reconstruction.
+
+- `LocalExecutor` evaluates on a local thread or process pool.
+- `SocketExecutor` sends every evaluation as a job to a `SimulatorServer`
+  over TCP. The server waits a configurable latency before it runs a job,
+  which mimics the queue of a remote simulator or QPU. Jobs and replies are
+  length-prefixed JSON, so the server never unpickles what it receives.
+
+usage: python executors.py serve [--port N] [--latency SECONDS] [--workers N] [--idle-timeout SECONDS]
+"""
+import abc
+import argparse
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+import pennylane as qml
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from numpy.typing import NDArray
+
+from circuits import cached_circuit, circuit_generators, default_device, default_qnode_kwargs, parameter_shapes
+
+Structure = tuple[str, int, int]
+ParamSet = tuple[NDArray[np.float_], NDArray[np.float_]]
+
+# larger messages are rejected, a job has a few thousand parameters at most
+max_message_size = 16 * 2**20
+
+_thread_circuits = threading.local()
+
+def _thread_circuit(structure: Structure, shots: int = None):
+    """
+    A QNode per thread: QNodes keep the tape of the running execution, so one
+    QNode must not be executed by several threads at once.
+    """
+    circuits = _thread_circuits.__dict__.setdefault("circuits", {})
+    if (structure, shots) not in circuits:
+        circuit = circuit_generators[structure[0]](num_qubits=structure[1], num_layers=structure[2])
+        if shots is not None:
+            circuit = qml.QNode(circuit.func, default_device(structure[1], shots=shots), **default_qnode_kwargs)
+        circuits[(structure, shots)] = circuit
+    return circuits[(structure, shots)]
+
+def _evaluate_in_thread(structure: Structure, shots: int, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> float:
+    return float(_thread_circuit(structure, shots)(rp_params, crp_params))
+
+def _evaluate_in_process(structure: Structure, shots: int, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> float:
+    # the QNode is built once per worker process
+    return float(cached_circuit(*structure, shots)(rp_params, crp_params))
+
+class Executor(abc.ABC):
+    """
+    Base class of the executors. Subclasses implement `submit`.
+    """
+    def __init__(self, circuit_id: str, num_qubits: int, num_layers: int, shots: int = None) -> None:
+        self.structure = (circuit_id, num_qubits, num_layers)
+        self.shots = shots
+        self.rp_shape, self.crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+        self.jobs = 0
+
+    @abc.abstractmethod
+    def submit(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> Future:
+        """
+        Starts the evaluation of one parameter set and returns the future of its cost.
+        """
+
+    def evaluate_many(self, param_sets: list[ParamSet]) -> list[Future]:
+        """
+        Starts the evaluations of all parameter sets at once.
+        """
+        return [self.submit(rp_params, crp_params) for rp_params, crp_params in param_sets]
+
+    def __call__(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]):
+        """
+        Evaluates like the QNode: returns a float, or an array of costs if a
+        parameter array has a trailing batch axis.
+        """
+        rp_params = np.asarray(rp_params, dtype=float)
+        crp_params = np.asarray(crp_params, dtype=float)
+        rp_batched = rp_params.shape != self.rp_shape
+        crp_batched = crp_params.shape != self.crp_shape
+        if not rp_batched and not crp_batched:
+            return self.submit(rp_params, crp_params).result()
+
+        batch_size = rp_params.shape[-1] if rp_batched else crp_params.shape[-1]
+        param_sets = [
+            (rp_params[..., i] if rp_batched else rp_params, crp_params[..., i] if crp_batched else crp_params)
+            for i in range(batch_size)
+        ]
+        return np.array([future.result() for future in self.evaluate_many(param_sets)])
+
+    def shutdown(self) -> None:
+        pass
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+class LocalExecutor(Executor):
+    """
+    Evaluates on a pool of `workers` threads, or processes if `processes` is
+    set. Simulations release the GIL only partly, so processes scale better
+    for larger circuits, at the cost of sending the parameters to the workers.
+    """
+    def __init__(self, circuit_id: str, num_qubits: int, num_layers: int, workers: int = None, processes: bool = False, shots: int = None) -> None:
+        super().__init__(circuit_id, num_qubits, num_layers, shots)
+        self.pool = ProcessPoolExecutor(max_workers=workers) if processes else ThreadPoolExecutor(max_workers=workers)
+        self._evaluate = _evaluate_in_process if processes else _evaluate_in_thread
+
+    def submit(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> Future:
+        self.jobs += 1
+        return self.pool.submit(self._evaluate, self.structure, self.shots, rp_params, crp_params)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+
+class JobError(RuntimeError):
+    """
+    A job failed on the server.
+    """
+
+def _send(connection: socket.socket, message: dict) -> None:
+    payload = json.dumps(message).encode()
+    connection.sendall(struct.pack("!I", len(payload)) + payload)
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+def _receive(connection: socket.socket) -> dict:
+    size, = struct.unpack("!I", _receive_exactly(connection, 4))
+    if size > max_message_size:
+        raise ValueError(f"message of {size} bytes exceeds {max_message_size}")
+    return json.loads(_receive_exactly(connection, size))
+
+def _encode_job(structure: Structure, shots: int, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> dict:
+    # floats survive JSON exactly (shortest repr round trip)
+    return {
+        "structure": list(structure),
+        "shots": shots,
+        "rp_params": np.asarray(rp_params, dtype=float).tolist(),
+        "crp_params": np.asarray(crp_params, dtype=float).tolist(),
+    }
+
+def _decode_job(job: dict) -> tuple[Structure, int, NDArray[np.float_], NDArray[np.float_]]:
+    circuit_id, num_qubits, num_layers = job["structure"]
+    if circuit_id not in circuit_generators:
+        raise ValueError(f"unknown circuit {circuit_id!r}")
+    structure = (str(circuit_id), int(num_qubits), int(num_layers))
+    shots = None if job["shots"] is None else int(job["shots"])
+    rp_shape, crp_shape = parameter_shapes(*structure)
+    rp_params = np.array(job["rp_params"], dtype=float).reshape(rp_shape)
+    crp_params = np.array(job["crp_params"], dtype=float).reshape(crp_shape)
+    return structure, shots, rp_params, crp_params
+
+class SimulatorServer(socketserver.ThreadingTCPServer):
+    """
+    Local stand-in for a remote simulator or QPU queue. Every job (structure,
+    shots, rp_params, crp_params) waits `latency` seconds and then runs on one
+    of `workers` simulator slots. Connections are kept open for many jobs, and
+    closed after `idle_timeout` seconds without a job (if given). A job that
+    fails gets an error reply instead of a value.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int] = ("127.0.0.1", 0), latency: float = 0.0, workers: int = 1, idle_timeout: float = None) -> None:
+        super().__init__(address, _JobHandler)
+        self.latency = latency
+        self.idle_timeout = idle_timeout
+        self.slots = threading.Semaphore(workers)
+        self.jobs = 0
+        self._jobs_lock = threading.Lock()
+
+    def count_job(self) -> None:
+        with self._jobs_lock:
+            self.jobs += 1
+
+    def start(self) -> "SimulatorServer":
+        """
+        Serves in a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class _JobHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        self.request.settimeout(self.server.idle_timeout)
+        while True:
+            try:
+                job = _receive(self.request)
+            except (ConnectionError, socket.timeout):
+                return
+            except ValueError as error:
+                # the framing may be broken, so the connection cannot be used anymore
+                _send(self.request, {"error": f"malformed job: {error}"})
+                return
+            try:
+                structure, shots, rp_params, crp_params = _decode_job(job)
+                time.sleep(self.server.latency)
+                with self.server.slots:
+                    reply = {"value": _evaluate_in_thread(structure, shots, rp_params, crp_params)}
+            except Exception as error:
+                reply = {"error": f"{type(error).__name__}: {error}"}
+            self.server.count_job()
+            _send(self.request, reply)
+
+class SocketExecutor(Executor):
+    """
+    Sends every evaluation to a `SimulatorServer` at `address`, with up to
+    `max_in_flight` jobs waiting at a time. Without an address, a local server
+    with the given `latency` and `server_workers` is started. A job that gets
+    no reply within `timeout` seconds raises `socket.timeout`, and a job that
+    failed on the server raises `JobError`.
+    """
+    def __init__(
+            self,
+            circuit_id: str,
+            num_qubits: int,
+            num_layers: int,
+            address: tuple[str, int] = None,
+            latency: float = 0.0,
+            server_workers: int = 1,
+            max_in_flight: int = 16,
+            shots: int = None,
+            timeout: float = 60.0,
+    ) -> None:
+        super().__init__(circuit_id, num_qubits, num_layers, shots)
+        self.timeout = timeout
+        self.server = None
+        if address is None:
+            self.server = SimulatorServer(latency=latency, workers=server_workers).start()
+            address = self.server.server_address
+        self.address = address
+        self.pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._connections = threading.local()
+
+    def _connection(self) -> socket.socket:
+        # one connection per client thread, so that requests and responses cannot interleave
+        if getattr(self._connections, "socket", None) is None:
+            self._connections.socket = socket.create_connection(self.address, timeout=self.timeout)
+        return self._connections.socket
+
+    def _run(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> float:
+        connection = self._connection()
+        try:
+            _send(connection, _encode_job(self.structure, self.shots, rp_params, crp_params))
+            reply = _receive(connection)
+        except OSError:
+            # a late reply would be taken for the next job's, so the connection is dropped
+            connection.close()
+            self._connections.socket = None
+            raise
+        if "error" in reply:
+            raise JobError(reply["error"])
+        return reply["value"]
+
+    def submit(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> Future:
+        self.jobs += 1
+        return self.pool.submit(self._run, rp_params, crp_params)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves circuit evaluations over TCP, like a remote simulator queue.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5757)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every job waits before it runs")
+    parser.add_argument("--workers", type=int, default=1, help="jobs that run at the same time")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="seconds after which idle connections are closed")
+    args = parser.parse_args()
+
+    server = SimulatorServer((args.host, args.port), latency=args.latency, workers=args.workers, idle_timeout=args.idle_timeout)
+    print(f"Serving on {server.server_address} with {args.latency}s latency and {args.workers} workers.")
+    server.serve_forever()
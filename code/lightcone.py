@@ -0,0 +1,138 @@
+"""
+Backward light-cone analysis of the `circuits.py` ansatz family.
+
+Walking the gates backwards from the measured observable, a gate can only
+change the cost if it touches a wire the observable (conjugated by the gates
+after it) acts on. While that conjugated observable is still diagonal, diagonal
+gates commute with it and drop out as well. Parameters that no remaining gate
+uses are inert: the cost does not depend on them.
+"""
+import pennylane as qml
+import numpy as np
+from functools import lru_cache
+from numpy.typing import NDArray
+
+from circuits import cached_circuit, default_device, default_qnode_kwargs, parameter_shapes
+from statevector import Operation, StatevectorEngine, cached_operations
+
+diagonal_gates = qml.ops.qubit.attributes.diagonal_in_z_basis
+
+class LightCone:
+    """
+    Result of the analysis: the wires and operations (in circuit order) that
+    can influence the cost and the parameters that cannot.
+    """
+    def __init__(
+            self,
+            num_qubits: int,
+            wires: list[int],
+            operations: list[Operation],
+            observable: qml.operation.Observable,
+            inert: set[tuple[str, tuple]],
+    ) -> None:
+        self.num_qubits = num_qubits
+        self.wires = wires
+        self.operations = operations
+        self.observable = observable
+        self.inert = inert
+        self.wire_map = {wire: position for position, wire in enumerate(wires)}
+
+    def live_indices(self, gate: str, shape: tuple) -> list[tuple]:
+        """
+        The parameter indices of `gate` that influence the cost, in sweep order.
+        """
+        return [index for index in np.ndindex(shape) if (gate, index) not in self.inert]
+
+    def reduced_operations(self) -> list[Operation]:
+        """
+        The operations of the cone on the wires renumbered to 0..len(wires)-1.
+        """
+        return [
+            Operation(
+                operation.name,
+                [self.wire_map[wire] for wire in operation.wires],
+                gate=operation.gate,
+                param_index=operation.param_index,
+                matrix=operation.matrix,
+                op_class=operation.op_class,
+            )
+            for operation in self.operations
+        ]
+
+def light_cone(
+        num_qubits: int,
+        operations: list[Operation],
+        observable: qml.operation.Observable,
+        rp_shape: tuple,
+        crp_shape: tuple,
+) -> LightCone:
+    wires = set(observable.wires.tolist())
+    diagonal = observable.name in diagonal_gates
+    kept = []
+    for operation in reversed(operations):
+        if wires.isdisjoint(operation.wires):
+            continue
+        if diagonal and operation.name in diagonal_gates:
+            continue
+        diagonal = False
+        wires.update(operation.wires)
+        kept.append(operation)
+    kept.reverse()
+
+    used = {(operation.gate, operation.param_index) for operation in kept if operation.parametrized}
+    inert = {
+        (gate, index)
+        for gate, shape in [("RP", rp_shape), ("CRP", crp_shape)]
+        for index in np.ndindex(shape)
+        if (gate, index) not in used
+    }
+    return LightCone(num_qubits, sorted(wires), kept, observable, inert)
+
+def _observable(circuit: qml.QNode, rp_shape: tuple, crp_shape: tuple) -> qml.operation.Observable:
+    with qml.tape.QuantumTape() as tape:
+        circuit.func(np.zeros(rp_shape), np.zeros(crp_shape))
+    assert len(tape.measurements) == 1, "only single expectation values are supported"
+    return tape.measurements[0].obs
+
+@lru_cache(maxsize=None)
+def cached_light_cone(circuit_id: str, num_qubits: int, num_layers: int) -> LightCone:
+    """
+    `light_cone` of a circuit structure, computed once per process.
+    """
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    circuit = cached_circuit(circuit_id, num_qubits, num_layers)
+    total_qubits, operations, _ = cached_operations(circuit_id, num_qubits, num_layers)
+    return light_cone(total_qubits, operations, _observable(circuit, rp_shape, crp_shape), rp_shape, crp_shape)
+
+@lru_cache(maxsize=None)
+def reduced_circuit(circuit_id: str, num_qubits: int, num_layers: int) -> qml.QNode:
+    """
+    A QNode with the same signature and cost as the circuit that only
+    simulates the wires and gates of its light cone.
+    """
+    cone = cached_light_cone(circuit_id, num_qubits, num_layers)
+    operations = cone.reduced_operations()
+    observable = cone.observable.map_wires(cone.wire_map)
+    dev = default_device(len(cone.wires))
+
+    @qml.qnode(dev, **default_qnode_kwargs)
+    def circuit(rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]):
+        for operation in operations:
+            if operation.parametrized:
+                params = rp_params if operation.gate == "RP" else crp_params
+                operation.op_class(params[operation.param_index], wires=operation.wires)
+            else:
+                operation.op_class(wires=operation.wires)
+        return qml.expval(observable)
+
+    return circuit
+
+def reduced_engine(circuit_id: str, num_qubits: int, num_layers: int, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> StatevectorEngine:
+    """
+    A `StatevectorEngine` of the light cone of a circuit structure, loaded with the given parameters.
+    """
+    cone = cached_light_cone(circuit_id, num_qubits, num_layers)
+    observable = qml.matrix(cone.observable, wire_order=cone.wires)
+    engine = StatevectorEngine(len(cone.wires), cone.reduced_operations(), observable)
+    engine.load(rp_params, crp_params)
+    return engine
@@ -1,35 +1,200 @@
 import math
-from scipy.optimize import minimize, Bounds
 import numpy as np
+from numpy.typing import ArrayLike, NDArray
+from reconstruction import base_frequency, crp_shifts, reconstruct_constants, rp_shifts
 
 def minimum_point(points: list[tuple[float, float]]) -> tuple[float, float]:
     return min(points, key = lambda point: point[1])
 
 
-def minimize_rp_reconstruction(reconstruction, constants, debug = False):
-    if constants['d5'] > 0:
-        x = - constants['d4']
+def rp_reconstruction_minimum(
+    d1: ArrayLike,
+    d4: ArrayLike,
+    d5: ArrayLike,
+) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+    """
+    Vectorized minimum of f(x) = d1 + d5 cos(x + d4): the cosine has to be -1
+    for positive and +1 for negative d5, so the minimum is d1 - |d5|.
+    (The original `minimize_rp_reconstruction` had the two cases swapped and
+    returned the maximum.)
+    """
+    d1, d4, d5 = np.broadcast_arrays(*(np.asarray(d, dtype=float) for d in (d1, d4, d5)))
+    x = np.where(d5 > 0, -d4 + math.pi, -d4)
+    return x, d1 - np.abs(d5)
+
+def minimize_reconstruction_constants(
+    constants: dict[str, NDArray[np.float_]],
+    gate: str = "CRP",
+    points_x: NDArray[np.float_] = None,
+    points_y: NDArray[np.float_] = None,
+) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+    """
+    Vectorized counterpart of `minimize_reconstruction` working on arrays of
+    constants as returned by `reconstruct_rp_constants`/`reconstruct_crp_constants`.
+    If sampled points are given (shape (..., #points)), the sanity check against
+    the lowest sampled point is applied per entry.
+    """
+    if gate == "RP":
+        x, y = rp_reconstruction_minimum(constants["d1"], constants["d4"], constants["d5"])
     else:
-        x = - constants['d4'] + math.pi
-    return x, reconstruction(x)
+        x, y = crp_reconstruction_minimum(*(constants[d] for d in ("d1", "d2", "d3", "d4", "d5")))
+
+    if points_x is not None:
+        lowest = np.argmin(points_y, axis=-1)[..., np.newaxis]
+        point_x = np.take_along_axis(np.broadcast_to(points_x, points_y.shape), lowest, axis=-1)[..., 0]
+        point_y = np.take_along_axis(points_y, lowest, axis=-1)[..., 0]
+        lower = point_y < y
+        x, y = np.where(lower, point_x, x), np.where(lower, point_y, y)
+
+    return x, y
+
+def reconstruct_and_minimize(
+    samples: ArrayLike,
+    thetas: ArrayLike,
+    gate: str = "CRP",
+) -> tuple[dict[str, NDArray[np.float_]], NDArray[np.float_], NDArray[np.float_]]:
+    """
+    Reconstruction and minimization of many parameters in one vectorized pass,
+    without creating per-parameter functions or dicts.
+    `samples` has shape (N, 3) for RP and (N, 6) for CRP, where `samples[n, i]`
+    is the cost at `thetas[n] + rp_shifts[i]` (`crp_shifts[i]`), and `thetas`
+    has shape (N,). Returns the constants d1..d5, the minimizing parameter
+    values and the minima, all of shape (N,). Like the single parameter
+    minimization, a sampled point is returned if it is lower than the minimum.
+    """
+    samples = np.asarray(samples, dtype=float)
+    thetas = np.asarray(thetas, dtype=float)
+    shifts = rp_shifts if gate == "RP" else crp_shifts
+    constants = reconstruct_constants(samples, thetas, gate)
+    x, y = minimize_reconstruction_constants(
+        constants,
+        gate,
+        points_x=thetas[..., np.newaxis] + shifts,
+        points_y=samples,
+    )
+    return constants, x, y
+
+def minimize_rp_reconstruction(reconstruction, constants, debug = False):
+    x, y = rp_reconstruction_minimum(constants['d1'], constants['d4'], constants['d5'])
+    x, y = float(x), float(y)
+
+    # sanity check: make sure to be lower than measured points
+    point_x, point_y = minimum_point(constants['points'])
+    if point_y < y:
+        if debug: print("yodl")
+        return point_x, point_y
+    return x, y
+
+def crp_reconstruction_minimum(
+    d1: ArrayLike,
+    d2: ArrayLike,
+    d3: ArrayLike,
+    d4: ArrayLike,
+    d5: ArrayLike,
+) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+    """
+    Finds the global minimum of f(x) = d1 + d3 cos(x/2 + d2) + d5 cos(x + d4)
+    in closed form. All constants may be arrays of the same shape, in which
+    case one minimum per entry is computed in a single vectorized pass.
+
+    Substituting t = x/2 + d2 and z = exp(i t), f'(x) = 0 becomes the quartic
+        2 d5 e^(i phi) z^4 + d3 z^3 - d3 z - 2 d5 e^(-i phi) = 0
+    with phi = d4 - 2 d2. Its roots (companion matrix eigenvalues) contain all
+    critical points of f; t = 0 and t = pi are added for the case d5 = 0.
+    Returns the minimizing x in [0, 4pi) and f(x).
+    """
+    d1, d2, d3, d4, d5 = np.broadcast_arrays(*(np.asarray(d, dtype=float) for d in (d1, d2, d3, d4, d5)))
+    shape = d1.shape
+    d1, d2, d3, d4, d5 = (d.reshape(-1) for d in (d1, d2, d3, d4, d5))
+
+    # the quartic degenerates if d5 vanishes; t = 0, pi cover that case
+    degenerate = np.abs(d5) < 1e-12
+    leading = 2 * np.where(degenerate, 1.0, d5) * np.exp(1j * (d4 - 2 * d2))
+    companion = np.zeros((d1.size, 4, 4), dtype=complex)
+    companion[:, 0, 0] = -d3 / leading
+    companion[:, 0, 2] = d3 / leading
+    companion[:, 0, 3] = np.conj(leading) / leading
+    companion[:, 1, 0] = companion[:, 2, 1] = companion[:, 3, 2] = 1
+
+    t = np.concatenate([
+        np.angle(np.linalg.eigvals(companion)),
+        np.broadcast_to([0, math.pi], (d1.size, 2)),
+    ], axis=1)
+    x = np.mod(2 * (t - d2[:, np.newaxis]), 4 * math.pi)
+    y = (
+        d1[:, np.newaxis]
+        + d3[:, np.newaxis] * np.cos(x / 2 + d2[:, np.newaxis])
+        + d5[:, np.newaxis] * np.cos(x + d4[:, np.newaxis])
+    )
+
+    best = np.argmin(y, axis=1)
+    rows = np.arange(d1.size)
+    return x[rows, best].reshape(shape), y[rows, best].reshape(shape)
 
 def minimize_crp_reconstruction(reconstruction, constants, debug = False):
-    min_y1 = 2 * math.pi - 2 * constants["d2"]
-    min_y2 = np.array([1, 3]) * math.pi - constants["d4"]
-    closer_min_y2 = min_y2[np.argmin(np.abs(min_y2 - min_y1))]
-    x0 = (min_y1 + closer_min_y2) / 2
-    
-    res = minimize(reconstruction, x0, bounds=Bounds(0, 4 * math.pi), method='Nelder-Mead', tol=1e-6)
+    x, y = crp_reconstruction_minimum(*(constants[d] for d in ("d1", "d2", "d3", "d4", "d5")))
+    x, y = float(x), float(y)
 
     # sanity check: make sure to be lower than measured points
-    x, y = minimum_point(constants['points'])
-    if y < res.fun:
+    point_x, point_y = minimum_point(constants['points'])
+    if point_y < y:
         if debug: print("yodl")
-        return x, y
+        return point_x, point_y
     else:
-        return res.x[0], res.fun
+        return x, y
+
+def spectrum_reconstruction_minimum(
+        coefficients: ArrayLike,
+        spectrum: tuple[float, ...],
+) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+    """
+    Global minimum of g(s) = a0 + sum_k a_k cos(w_k s) + b_k sin(w_k s) for
+    coefficients as returned by `reconstruction.spectrum_coefficients`, one
+    row of coefficients per entry of the leading axes.
+
+    With the base frequency w of the spectrum, w_k = m_k w and z = exp(i w s),
+    z^R g'(s) is a polynomial of degree 2R in z (R = max m_k) whose unit-circle
+    roots contain all critical points. Returns the minimizing s in [0, 2pi/w) and g(s).
+    """
+    coefficients = np.asarray(coefficients, dtype=float)
+    shape = coefficients.shape[:-1]
+    coefficients = coefficients.reshape(-1, coefficients.shape[-1])
+    base, multiples = base_frequency(spectrum)
+    degree = max(multiples, default=0)
+    frequencies = base * np.array(multiples)
+
+    xs, ys = [], []
+    for a0, a, b in zip(coefficients[:, 0], coefficients[:, 1::2], coefficients[:, 2::2]):
+        # polynomial coefficients of z^R g'(s) / (i w / 2), highest power first
+        polynomial = np.zeros(2 * degree + 1, dtype=complex)
+        for multiple, a_k, b_k in zip(multiples, a, b):
+            polynomial[degree - multiple] += multiple * (a_k - 1j * b_k)
+            polynomial[degree + multiple] += -multiple * (a_k + 1j * b_k)
+        nonzero = np.flatnonzero(np.abs(polynomial) > 1e-12)
+        roots = np.roots(polynomial[nonzero[0]:nonzero[-1] + 1]) if len(nonzero) > 1 else np.array([])
+        # s = 0 covers constant functions
+        s = np.mod(np.concatenate([np.angle(roots[roots != 0]), [0.0]]) / base, 2 * math.pi / base)
+        y = a0 + np.cos(np.outer(s, frequencies)) @ a + np.sin(np.outer(s, frequencies)) @ b
+        best = np.argmin(y)
+        xs.append(s[best])
+        ys.append(y[best])
+
+    return np.array(xs).reshape(shape), np.array(ys).reshape(shape)
+
+def minimize_spectrum_reconstruction(reconstruction, constants, debug = False):
+    s, y = spectrum_reconstruction_minimum(constants["coefficients"], constants["spectrum"])
+    x, y = float(constants["theta"] + s), float(y)
+
+    # sanity check: make sure to be lower than measured points
+    point_x, point_y = minimum_point(constants['points'])
+    if point_y < y:
+        if debug: print("yodl")
+        return point_x, point_y
+    return x, y
 
 def minimize_reconstruction(reconstruction, constants, debug = False, gate = "CRP"):
+    if "spectrum" in constants:
+        return minimize_spectrum_reconstruction(reconstruction, constants, debug)
     if gate == "RP":
         return minimize_rp_reconstruction(reconstruction, constants, debug)
     else:
@@ -0,0 +1,189 @@
+import pennylane.numpy as np
+from numpy.typing import NDArray
+from pennylane import QNode
+from math import pi
+
+from CrotosolveOptimizer import CrotosolveOptimizer
+from executors import Executor
+from minimization import minimize_reconstruction_constants
+from optimizers import OptimizationTask
+from results import OptimizationResult
+
+def _stack_params(tasks: list[OptimizationTask]) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+    """
+    Stacks the initial parameters of all tasks along a trailing batch axis,
+    which is the axis the circuits in `circuits.py` broadcast over.
+    """
+    first = tasks[0]
+    for task in tasks:
+        assert (task.circuit_id, task.num_qubits, task.num_layers) == (first.circuit_id, first.num_qubits, first.num_layers), \
+            "all tasks of a multi-start run need the same circuit"
+        assert all(np.shape(p) == np.shape(q) for p, q in zip(task.initial_params, first.initial_params)), \
+            "all tasks of a multi-start run need the same parameter shapes"
+
+    return tuple(
+        np.stack([np.array(task.initial_params[i], dtype=float) for task in tasks], axis=-1)
+        for i in range(2)
+    )
+
+def _record_sweep(
+        results: list[OptimizationResult],
+        tasks: list[OptimizationTask],
+        active: NDArray[np.int_],
+        sub_cost: NDArray[np.float_],
+        num_rp_params: int,
+        rp_evaluations: int,
+        crp_evaluations: int,
+        sweep_overhead: int,
+) -> NDArray[np.bool_]:
+    """
+    Appends the costs after every update of a sweep to the loss curves of the
+    active starts, counting evaluations like the single-start optimizers do.
+    Like those, a start only gets the updates that fit into its budget.
+    Returns which starts used up their budget, i.e. cannot run another sweep.
+    """
+    costs = [rp_evaluations] * num_rp_params + [crp_evaluations] * (len(sub_cost) - num_rp_params)
+    if len(costs) > 0:
+        costs[0] += sweep_overhead
+    evaluations = np.cumsum(costs)
+
+    exhausted = np.zeros(len(active), dtype=bool)
+    for column, start in enumerate(active):
+        evaluations_so_far = results[start].total_evaluations
+        max_evaluations = tasks[start].max_evaluations
+        for evs, value in zip(evaluations, sub_cost[:, column]):
+            if evaluations_so_far + evs > max_evaluations:
+                # the rest of the sweep was simulated, but does not count
+                exhausted[column] = True
+                break
+            results[start].append(int(evaluations_so_far + evs), float(value))
+        if len(costs) > 0 and results[start].total_evaluations + costs[0] > max_evaluations:
+            exhausted[column] = True
+    return exhausted
+
+def _run_multistart(tasks: list[OptimizationTask], step, rp_evaluations: int, crp_evaluations: int, sweep_overhead: int, debug: bool = False, executor: Executor = None) -> list[OptimizationResult]:
+    circuit = tasks[0].circuit if executor is None else executor
+    rp_params, crp_params = _stack_params(tasks)
+    num_rp_params = rp_params[..., 0].size
+
+    initial_cost = np.reshape(circuit(rp_params, crp_params), len(tasks))
+    results = [OptimizationResult(loss=[(0, float(cost))]) for cost in initial_cost]
+
+    thresholds = np.array([task.convergence_threshold for task in tasks])
+    active = np.arange(len(tasks))
+
+    iteration = 0
+    while len(active) > 0:
+        (new_rp_params, new_crp_params), prev_cost, sub_cost = step(circuit, rp_params[..., active], crp_params[..., active])
+        rp_params[..., active] = new_rp_params
+        crp_params[..., active] = new_crp_params
+        exhausted = _record_sweep(results, tasks, active, sub_cost, num_rp_params, rp_evaluations, crp_evaluations, sweep_overhead)
+        if debug and np.any(exhausted): print("budget exhausted", iteration, active[exhausted])
+
+        iteration += 1
+        current_cost = np.reshape(circuit(new_rp_params, new_crp_params), len(active))
+        converged = np.abs(current_cost - prev_cost) <= thresholds[active]
+        if debug and np.any(converged & ~exhausted): print("abort", iteration, active[converged & ~exhausted])
+        active = active[~converged & ~exhausted]
+
+    return results
+
+def optimize_crotosolve_multistart(tasks: list[OptimizationTask], debug: bool = False, executor: Executor = None) -> list[OptimizationResult]:
+    """
+    Runs Crotosolve for all tasks (random starts of the same circuit) in
+    lockstep and returns one result per task. The loss curves count
+    evaluations like `optimize_crotosolve` and end with the last update that
+    fits into the budget. The lockstep sweep still simulates the updates
+    after it, they are just not recorded. With an `executor` (see
+    `executors.py`), the evaluations of all starts run concurrently on it.
+    """
+    optimizer = CrotosolveOptimizer()
+
+    return _run_multistart(
+        tasks,
+        optimizer.step_and_cost_multistart,
+        rp_evaluations=2,
+        crp_evaluations=5,
+        sweep_overhead=1,
+        debug=debug,
+        executor=executor,
+    )
+
+def _rotosolve_step_multistart(circuit: QNode, initial_rp_params: NDArray[np.float_], initial_crp_params: NDArray[np.float_]):
+    """
+    One Rotosolve sweep for many starting points in lockstep, with the same
+    sample points as `qml.RotosolveOptimizer` given the circuit spectra
+    (3 evaluations per RP and 5 equidistant ones per CRP parameter, where the
+    first parameter reuses the cost before the sweep).
+    RP parameters use the closed-form update of `RotosolveOptimizer.min_analytic`.
+    CRP parameters are reconstructed from their discrete Fourier transform and
+    minimized in closed form instead of with a brute-force grid search, so the
+    updates are not bit-identical to `optimize_rotosolve`.
+    """
+    rp_params = np.array(initial_rp_params, dtype=float, requires_grad=False)
+    crp_params = np.array(initial_crp_params, dtype=float, requires_grad=False)
+    num_starts = rp_params.shape[-1]
+
+    prev = np.reshape(circuit(rp_params, crp_params), num_starts)
+    y_output = []
+    first = True
+
+    for params, gate, shifts in [
+        (rp_params, "RP", np.array([0, 1/2, -1/2]) * pi),
+        (crp_params, "CRP", np.arange(-2, 3) * 4 * pi / 5),
+    ]:
+        zero = int(np.argmin(np.abs(shifts)))
+        for param_index in np.ndindex(params.shape[:-1]):
+            thetas = params[param_index]
+
+            evaluated = [i for i in range(len(shifts)) if not (first and i == zero)]
+            shifted_params = np.repeat(params, len(evaluated), axis=-1)
+            shifted_params[param_index] = (thetas[:, np.newaxis] + shifts[np.newaxis, evaluated]).reshape(-1)
+            if gate == "RP":
+                values = circuit(shifted_params, np.repeat(crp_params, len(evaluated), axis=-1))
+            else:
+                values = circuit(np.repeat(rp_params, len(evaluated), axis=-1), shifted_params)
+
+            samples = np.empty((num_starts, len(shifts)))
+            samples[:, evaluated] = np.reshape(values, (num_starts, len(evaluated)))
+            if first:
+                samples[:, zero] = prev
+            first = False
+
+            if gate == "RP":
+                f0, fp, fm = samples.T
+                c = (fp + fm) / 2
+                x = thetas - pi / 2 - np.arctan2(2 * f0 - fp - fm, fp - fm)
+                y = c - np.sqrt((f0 - c) ** 2 + (fp - fm) ** 2 / 4)
+            else:
+                # in t = x/2 the samples are equidistant over one period with frequencies 0, 1, 2
+                fourier = np.fft.fft(np.roll(samples, -zero, axis=1), axis=1) / len(shifts)
+                constants = {
+                    "d1": np.real(fourier[:, 0]),
+                    "d2": np.angle(fourier[:, 1]) - thetas / 2,
+                    "d3": 2 * np.abs(fourier[:, 1]),
+                    "d4": np.angle(fourier[:, 2]) - thetas,
+                    "d5": 2 * np.abs(fourier[:, 2]),
+                }
+                x, y = minimize_reconstruction_constants(constants, gate)
+
+            params[param_index] = x
+            y_output.append(y)
+
+    return (rp_params, crp_params), prev, np.array(y_output).reshape(-1, num_starts)
+
+def optimize_rotosolve_multistart(tasks: list[OptimizationTask], debug: bool = False) -> list[OptimizationResult]:
+    """
+    Runs Rotosolve for all tasks (random starts of the same circuit) in
+    lockstep and returns one result per task. The loss curves count
+    evaluations like `optimize_rotosolve` and end with the last update that
+    fits into the budget.
+    """
+    return _run_multistart(
+        tasks,
+        _rotosolve_step_multistart,
+        rp_evaluations=3,
+        crp_evaluations=5,
+        sweep_overhead=0,
+        debug=debug,
+    )
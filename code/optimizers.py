@@ -3,10 +3,21 @@ import pennylane.numpy as np
 from pennylane import QNode
 from numpy.typing import NDArray
 from CrotosolveOptimizer import CrotosolveOptimizer
+from statevector import StatevectorEngine
+from results import OptimizationResult
+from evaluation import EvaluationBudget, EvaluationCache
+from structure import cached_block_groups
+from lightcone import cached_light_cone, reduced_circuit, reduced_engine
+from reconstruction import least_squares_shifts
+from executors import Executor
+from ordering import AdaptiveOrdering
+from parameters import ParameterRegistry
+from profiling import TimedCircuit, UpdateEvent, labelled
 from typing import Callable
 
-from circuits import circuit_generators
+from circuits import cached_circuit
 from math import ceil
+import time
 
 class OptimizationTask:
     def __init__(
@@ -17,14 +28,17 @@ class OptimizationTask:
             initial_params: tuple[NDArray[np.float_], NDArray[np.float_]],
             max_evaluations: int = 250,
             convergence_threshold: float = 1e-6,
+            shots: int = None,
     ) -> None:
+        """
+        With `shots`, the circuit estimates the cost from that many samples
+        per evaluation and loss curves count shots instead of evaluations.
+        """
         self.circuit_id = circuit_id
         self.num_qubits = num_qubits
         self.num_layers = num_layers
-        self.circuit = circuit_generators[self.circuit_id](
-            num_qubits=self.num_qubits,
-            num_layers=self.num_layers
-        )
+        self.shots = shots
+        self.circuit = cached_circuit(self.circuit_id, self.num_qubits, self.num_layers, self.shots)
 
         self.max_evaluations = max_evaluations
         self.convergence_threshold = convergence_threshold
@@ -36,128 +50,325 @@ class OptimizationTask:
         return state
 
     def __setstate__(self, state: dict):
+        # tasks pickled before shots were supported are analytic
+        self.shots = None
         self.__dict__.update(state)
-        self.circuit = circuit_generators[self.circuit_id](
-            num_qubits=self.num_qubits,
-            num_layers=self.num_layers
-        )
-
-class OptimizationResult:
-    def __init__(self, loss: list[tuple[int, float]]) -> None:
-        self.loss = loss
-
-def optimize_crotosolve(task: OptimizationTask, debug: bool = False) -> OptimizationResult:
-    max_iterations = ceil(task.max_evaluations / (1 + 2 * task.initial_params[0].size + 5 * task.initial_params[1].size))
-    optimizer = CrotosolveOptimizer()
-
-    cost = [(0, float(task.circuit(*task.initial_params)))]
+        self.circuit = cached_circuit(self.circuit_id, self.num_qubits, self.num_layers, self.shots)
+
+def _shared_circuit(task: OptimizationTask) -> Callable:
+    """
+    The task's circuit behind the process-wide value cache. With shots,
+    repeated evaluations are independent samples, so nothing is cached.
+    """
+    if task.shots is not None:
+        return task.circuit
+    return EvaluationCache.shared(task.circuit)
+
+def _executor_circuit(task: OptimizationTask, executor: Executor) -> Callable:
+    """
+    The executor behind the process-wide value cache (without shots), like `_shared_circuit`.
+    """
+    if executor.structure != (task.circuit_id, task.num_qubits, task.num_layers) or executor.shots != task.shots:
+        raise ValueError("the executor must evaluate the task's circuit")
+    if task.shots is not None:
+        return executor
+    return EvaluationCache.shared(executor)
+
+def _label(task: OptimizationTask) -> str:
+    return f"{task.circuit_id}_{task.num_qubits}x{task.num_layers}"
+
+def _report_step(
+        callback: Callable[[UpdateEvent], None],
+        started: float,
+        evaluated: float,
+        evaluations: int,
+        loss_before: float,
+        loss_after: float,
+        iteration: int,
+) -> None:
+    """
+    Calls `callback` with the event of a gradient step that started at
+    `started` and was done with its circuits (forward and gradient) at `evaluated`.
+    """
+    if callback is None:
+        return
+    callback(UpdateEvent(
+        None,
+        None,
+        evaluations,
+        loss_before,
+        loss_after,
+        evaluation_seconds=evaluated - started,
+        other_seconds=time.perf_counter() - evaluated,
+        sweep=iteration,
+    ))
+
+def _report_rotosolve_sweep(
+        callback: Callable[[UpdateEvent], None],
+        calls: list[tuple[float, float]],
+        finished: float,
+        updates: list[tuple[str, tuple, int]],
+        prev_cost: float,
+        sub_cost: list[float],
+        iteration: int,
+) -> None:
+    """
+    Calls `callback` with an event per (gate, param_index, evaluations)
+    update of a Rotosolve sweep. The circuit calls of the sweep, as
+    (start, end) times, are attributed to the updates in order by their
+    evaluations. The time from an update's first call to the next update's
+    first call that is not spent in its calls counts as minimization, which
+    includes Rotosolve's reconstruction.
+    """
+    if callback is None:
+        return
+    boundaries = np.cumsum([0] + [evaluations for _, _, evaluations in updates])
+    losses = [prev_cost] + list(sub_cost)
+    for i, (gate, param_index, evaluations) in enumerate(updates):
+        update_calls = calls[boundaries[i]:boundaries[i + 1]]
+        if len(update_calls) == 0:
+            break
+        end = calls[boundaries[i + 1]][0] if boundaries[i + 1] < len(calls) else finished
+        evaluation_seconds = sum(call_end - call_start for call_start, call_end in update_calls)
+        callback(UpdateEvent(
+            gate,
+            param_index,
+            evaluations,
+            losses[i],
+            losses[i + 1],
+            evaluation_seconds=evaluation_seconds,
+            minimization_seconds=end - update_calls[0][0] - evaluation_seconds,
+            sweep=iteration,
+        ))
+
+def _gradient_step_cost(task: OptimizationTask, tracker: qml.Tracker) -> int:
+    """
+    What a gradient step adds to the loss curve: its two evaluations, or with
+    shots, the shots of all circuits it ran, including the parameter-shift ones.
+    """
+    if task.shots is None:
+        return tracker.totals['batches']
+    return tracker.totals['shots']
+
+def _count_shots(task: OptimizationTask, result: OptimizationResult) -> OptimizationResult:
+    """
+    Converts a loss curve over evaluations into one over total shots.
+    """
+    if task.shots is None:
+        return result
+    return OptimizationResult.from_arrays(result.evaluations * task.shots, result.values.copy())
+
+def optimize_crotosolve(task: OptimizationTask, debug: bool = False, batched: bool = True, engine: bool = False, exact: bool = False, blocks: bool = False, prune: bool = False, spectra: bool = False, executor: Executor = None, adaptive: bool = False, callback: Callable[[UpdateEvent], None] = None) -> OptimizationResult:
+    """
+    If `engine` is set, the circuit is simulated by a `StatevectorEngine`
+    instead of the task's QNode. The evaluation accounting is the same.
+    If `exact` is set, the engine computes the reconstructions from exact
+    Fourier coefficients; the loss curve still counts the evaluations a
+    sampled reconstruction would have needed.
+    If `blocks` is set, separable groups of parameters (see `structure.py`)
+    are updated at once. The loss curve still has one entry per parameter.
+    If `prune` is set, parameters outside the light cone of the observable
+    (see `lightcone.py`) are skipped, which costs them no evaluations and
+    no loss curve entries, and only the light cone is simulated.
+    The last sweep stops as soon as the next update would exceed the budget.
+    With shots, each parameter is reconstructed by a least-squares fit (see
+    `reconstruction.least_squares_shifts`), which rules out the engine,
+    blocks and pruning.
+    If `spectra` is set, each parameter is reconstructed from its frequency
+    spectrum as derived from the circuit (see `structure.parameter_spectra`),
+    which also covers parameters shared by several gates. Its samples are
+    placed differently, so the loss curve differs from the default one.
+    If an `executor` (see `executors.py`) for the task's circuit structure is
+    given, it evaluates the circuit instead of the task's QNode, so that the
+    shifted evaluations of a (batched) reconstruction run concurrently.
+    If `adaptive` is set, sweeps visit the parameters in the order of an
+    `ordering.AdaptiveOrdering`, which skips parameters that gained little in
+    their last update, with a full sweep every few sweeps and after a
+    partial sweep that stalled. Convergence is only checked after full sweeps.
+    A `callback` is called with an `UpdateEvent` (see `profiling.py`) after
+    every parameter update.
+    """
+    engine = engine or exact
+    if executor is not None and (engine or prune):
+        raise ValueError("the executor cannot be combined with the engine or pruning")
+    if task.shots is not None and (engine or blocks or prune):
+        raise ValueError("finite-shot tasks are only supported on the task's QNode without blocks or pruning")
+    if adaptive and (blocks or prune):
+        raise ValueError("adaptive ordering cannot be combined with blocks or pruning")
+    structure = (task.circuit_id, task.num_qubits, task.num_layers)
+    groups = cached_block_groups(*structure) if blocks else None
+    if prune:
+        cone = cached_light_cone(*structure)
+        if groups is None:
+            groups = {gate: [[index] for index in np.ndindex(np.shape(p))] for gate, p in zip(["RP", "CRP"], task.initial_params)}
+        # leaving out inert members keeps a group separable
+        groups = {
+            gate: [live for live in ([index for index in group if (gate, index) not in cone.inert] for group in gate_groups) if live]
+            for gate, gate_groups in groups.items()
+        }
+        circuit = reduced_engine(*structure, *task.initial_params) if engine else EvaluationCache.shared(reduced_circuit(*structure))
+    elif executor is not None:
+        circuit = _executor_circuit(task, executor)
+    else:
+        circuit = StatevectorEngine.from_structure(*structure, *task.initial_params) if engine else _shared_circuit(task)
+
+    shifts = {gate: least_squares_shifts(gate) for gate in ["RP", "CRP"]} if task.shots is not None else None
+    registry = ParameterRegistry.from_structure(*structure)
+    parameter_spectra = registry.spectra() if spectra else None
+    if groups is None:
+        updates = [info.key for info in registry]
+    else:
+        updates = [(gate, index) for gate in ["RP", "CRP"] for group in groups[gate] for index in group]
+    ordering = AdaptiveOrdering(registry) if adaptive else None
+    if callback is not None:
+        callback = labelled(callback, _label(task), "Crotosolve")
+    optimizer = CrotosolveOptimizer(batched=batched, exact=exact, groups=groups, shifts=shifts, spectra=parameter_spectra, ordering=ordering, callback=callback)
+    budget = EvaluationBudget(circuit, task.max_evaluations)
+    update_costs = [optimizer.evaluations_for(*update) for update in updates]
+    # the cost before a sweep is accounted with its first update if the default
+    # order starts with an RP update (and not at all for circuits without RP parameters)
+    sweep_offset = 1 if updates[0][0] == "RP" else 0
+
+    result = OptimizationResult(loss=[(0, float(circuit(*task.initial_params)))])
     params = task.initial_params
-    for iteration in range(max_iterations):
-        with qml.Tracker(task.circuit.device) as tracker:
-            params, prev_cost, sub_cost = optimizer.step_and_cost(
-                task.circuit,
-                *params,
-                full_output=True
-            )
-            # assert that the #evaluations estimate is correct
-            assert tracker.totals['batches'] == 1 + 2 * params[0].size + 5 * params[1].size
+    iteration = 0
+    # a sweep needs the cost before it and at least one update
+    while budget.allows(1 + (min(update_costs) if adaptive else update_costs[0])):
+        engine_evaluations = circuit.evaluations if engine else 0
+        budget_evaluations = budget.evaluations
+        params, prev_cost, sub_cost = optimizer.step_and_cost(
+            budget,
+            *params,
+            full_output=True
+        )
 
-        sub_cost_rp = sub_cost[:params[0].size]
-        sub_cost_crp = sub_cost[params[0].size:]
+        # assert that the #evaluations estimate is correct
+        # (broadcasted executions count once per evaluated parameter set)
+        evaluations = circuit.evaluations - engine_evaluations if engine else budget.evaluations - budget_evaluations
+        sweep_costs = [optimizer.evaluations_for(*update) for update in optimizer.last_updates]
+        assert exact or evaluations == 1 + sum(sweep_costs)
 
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.extend([
-            (
-                evaluations_so_far + 1 + 2 * (cost_idx + 1),
-                float(cost_value)
-            )
-            for (cost_idx, cost_value)
-            in enumerate(sub_cost_rp)
-        ])
-
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.extend([
-            (
-                evaluations_so_far + 5 * (cost_idx + 1),
-                float(cost_value)
-            )
-            for (cost_idx, cost_value)
-            in enumerate(sub_cost_crp)
-        ])
+        # evaluations of the sweep up to each update
+        update_evaluations = sweep_offset + np.cumsum(sweep_costs)
+        evaluations_so_far = result.total_evaluations
+        for cost_value, evaluations in zip(sub_cost, update_evaluations):
+            result.append(evaluations_so_far + int(evaluations), float(cost_value))
 
-        if np.abs(task.circuit(*params) - prev_cost) <= task.convergence_threshold:
+        if len(sub_cost) < len(ordering.visits if adaptive else updates):
+            if debug: print("budget exhausted", iteration)
+            break
+        if adaptive and not ordering.full_sweep:
+            # a stalled partial sweep is followed by a full one, which decides about convergence
+            if len(sub_cost) == 0 or np.abs(sub_cost[-1] - prev_cost) <= task.convergence_threshold:
+                ordering.refresh()
+            iteration += 1
+            continue
+        if np.abs(circuit(*params) - prev_cost) <= task.convergence_threshold:
             if debug: print("abort", iteration)
             break
-
-    return OptimizationResult(loss=cost)
-
-def optimize_rotosolve(task: OptimizationTask, debug: bool = False) -> OptimizationResult:
-    max_iterations = ceil(task.max_evaluations / (3 * task.initial_params[0].size + 5 * task.initial_params[1].size))
-
+        iteration += 1
+
+    return _count_shots(task, result)
+
+def optimize_rotosolve(task: OptimizationTask, debug: bool = False, callback: Callable[[UpdateEvent], None] = None, executor: Executor = None) -> OptimizationResult:
+    """
+    `qml.RotosolveOptimizer` always finishes its sweep, so evaluations after
+    the budget ran out are not simulated (the circuit returns a placeholder)
+    and the updates that depend on them are dropped from the loss curve.
+    A `callback` is called with an `UpdateEvent` (see `profiling.py`) for
+    every update in the loss curve. An `executor` (see `executors.py`) for the task's circuit
+    structure evaluates the circuit instead of the task's QNode.
+    """
     optimizer = qml.RotosolveOptimizer()
     params = task.initial_params
+    # the first parameter of a sweep reuses the cost before the sweep, so all cost 3 or 5 evaluations
+    rp_evaluations, crp_evaluations = 3, 5
+    circuit = _shared_circuit(task) if executor is None else _executor_circuit(task, executor)
+    budget = EvaluationBudget(circuit, task.max_evaluations, placeholder=0.0)
+    timed_budget = TimedCircuit(budget, record_calls=callback is not None)
+    if callback is not None:
+        callback = labelled(callback, _label(task), "Rotosolve")
+    updates = [
+        (gate, index, gate_evaluations)
+        for gate, p, gate_evaluations in zip(["RP", "CRP"], params, [rp_evaluations, crp_evaluations])
+        for index in np.ndindex(np.shape(p))
+    ]
 
     spectrum_fn = qml.fourier.qnode_spectrum(task.circuit)
     spectra = spectrum_fn(*params)
-    cost = [(0, float(task.circuit(*task.initial_params)))]
-    for iteration in range(max_iterations):
-        with qml.Tracker(task.circuit.device) as tracker:
-            params, prev_cost, sub_cost = optimizer.step_and_cost(
-                task.circuit,
-                *params,
-                spectra=spectra,
-                full_output=True
-            )
-            assert tracker.totals['batches'] == 3 * params[0].size + 5 * params[1].size
+    result = OptimizationResult(loss=[(0, float(circuit(*task.initial_params)))])
+    iteration = 0
+    while budget.remaining > 0:
+        budget_evaluations = budget.evaluations
+        timed_budget.calls.clear()
+        params, prev_cost, sub_cost = optimizer.step_and_cost(
+            timed_budget,
+            *params,
+            spectra=spectra,
+            full_output=True
+        )
+        curve_length = len(result)
 
         sub_cost_rp = sub_cost[:params[0].size]
         sub_cost_crp = sub_cost[params[0].size:]
 
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.extend([
-            (
-                evaluations_so_far + 3 * (cost_idx + 1),
-                float(cost_value)
-            )
-            for (cost_idx, cost_value)
-            in enumerate(sub_cost_rp)
-        ])
-
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.extend([
-            (
-                evaluations_so_far + 5 * (cost_idx + 1),
-                float(cost_value)
-            )
-            for (cost_idx, cost_value)
-            in enumerate(sub_cost_crp)
-        ])
+        evaluations_so_far = result.total_evaluations
+        for (cost_idx, cost_value) in enumerate(sub_cost_rp):
+            evaluations = evaluations_so_far + rp_evaluations * (cost_idx + 1)
+            if evaluations <= task.max_evaluations:
+                result.append(evaluations, float(cost_value))
+
+        evaluations_so_far = evaluations_so_far + rp_evaluations * len(sub_cost_rp)
+        for (cost_idx, cost_value) in enumerate(sub_cost_crp):
+            evaluations = evaluations_so_far + crp_evaluations * (cost_idx + 1)
+            if evaluations <= task.max_evaluations:
+                result.append(evaluations, float(cost_value))
 
-        if np.abs(task.circuit(*params) - prev_cost) <= task.convergence_threshold:
+        # updates after the budget ran out were evaluated on placeholders and are not reported
+        recorded = len(result) - curve_length
+        _report_rotosolve_sweep(callback, timed_budget.calls, time.perf_counter(), updates[:recorded], prev_cost, sub_cost[:recorded], iteration)
+
+        if budget.remaining <= 0:
+            if debug: print("budget exhausted", iteration)
+            break
+        assert budget.evaluations - budget_evaluations == rp_evaluations * params[0].size + crp_evaluations * params[1].size
+
+        if np.abs(circuit(*params) - prev_cost) <= task.convergence_threshold:
             if debug: print("abort", iteration)
             break
+        iteration += 1
 
-    return OptimizationResult(loss=cost)
+    return _count_shots(task, result)
 
-def optimize_gradientdescent(task: OptimizationTask, debug = False) -> OptimizationResult:
+def optimize_gradientdescent(task: OptimizationTask, debug = False, callback: Callable[[UpdateEvent], None] = None) -> OptimizationResult:
     max_iterations = ceil(task.max_evaluations / 2) # 2 evals per iteration
 
     optimizer = qml.GradientDescentOptimizer()
     params = task.initial_params
+    circuit = _shared_circuit(task)
+    if callback is not None:
+        callback = labelled(callback, _label(task), "Gradient Descent")
 
-    cost = [(0, float(task.circuit(*task.initial_params)))]
+    result = OptimizationResult(loss=[(0, float(circuit(*task.initial_params)))])
     for iteration in range(max_iterations):
+        started = time.perf_counter()
         with qml.Tracker(task.circuit.device) as tracker:
             params, prev_cost = optimizer.step_and_cost(
-                task.circuit,
+                circuit,
                 *params,
             )
+        evaluated = time.perf_counter()
         evaluations_here = tracker.totals['batches']
-        assert evaluations_here == 2, "Gradient needs two evaluations!"
-        current_cost = float(task.circuit(*params))
-
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.append((evaluations_so_far + evaluations_here, current_cost))
+        # with shots, the step is charged by the tracker's shots instead
+        assert task.shots is not None or evaluations_here == 2, "Gradient needs two evaluations!"
+        current_cost = float(circuit(*params))
+        _report_step(callback, started, evaluated, evaluations_here, prev_cost, current_cost, iteration)
+
+        step_cost = _gradient_step_cost(task, tracker)
+        if task.shots is not None and result.total_evaluations + step_cost > task.max_evaluations * task.shots:
+            if debug: print("budget exhausted", iteration)
+            break
+        result.append(result.total_evaluations + step_cost, current_cost)
 
         if np.abs(current_cost - prev_cost) <= task.convergence_threshold:
             if debug: print("abort", iteration)
@@ -165,61 +376,84 @@ def optimize_gradientdescent(task: OptimizationTask, debug = False) -> Optimizat
         if debug and iteration % 20 == 0:
             print(iteration, current_cost)
 
-    return OptimizationResult(loss=cost)
+    # with shots, the loss curve already counts shots
+    return result
 
-def optimize_adam(task: OptimizationTask, debug: bool = False) -> OptimizationResult:
+def optimize_adam(task: OptimizationTask, debug: bool = False, callback: Callable[[UpdateEvent], None] = None) -> OptimizationResult:
     max_iterations = ceil(task.max_evaluations / 2) # 2 evals per iteration
     optimizer = qml.AdamOptimizer()
     params = task.initial_params
+    circuit = _shared_circuit(task)
+    if callback is not None:
+        callback = labelled(callback, _label(task), "Adam")
 
-    cost = [(0, float(task.circuit(*task.initial_params)))]
+    result = OptimizationResult(loss=[(0, float(circuit(*task.initial_params)))])
     for iteration in range(max_iterations):
+        started = time.perf_counter()
         with qml.Tracker(task.circuit.device) as tracker:
             params, prev_cost = optimizer.step_and_cost(
-                task.circuit,
+                circuit,
                 *params,
             )
+        evaluated = time.perf_counter()
         evaluations_here = tracker.totals['batches']
-        assert evaluations_here == 2, "Gradient needs two evaluations!"
-        current_cost = float(task.circuit(*params))
-
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.append((evaluations_so_far + evaluations_here, current_cost))
+        # with shots, the step is charged by the tracker's shots instead
+        assert task.shots is not None or evaluations_here == 2, "Gradient needs two evaluations!"
+        current_cost = float(circuit(*params))
+        _report_step(callback, started, evaluated, evaluations_here, prev_cost, current_cost, iteration)
+
+        step_cost = _gradient_step_cost(task, tracker)
+        if task.shots is not None and result.total_evaluations + step_cost > task.max_evaluations * task.shots:
+            if debug: print("budget exhausted", iteration)
+            break
+        result.append(result.total_evaluations + step_cost, current_cost)
 
-        if np.abs(task.circuit(*params) - prev_cost) <= task.convergence_threshold:
+        if np.abs(circuit(*params) - prev_cost) <= task.convergence_threshold:
             if debug: print("abort", iteration)
             break
         if debug and iteration % 20 == 0:
             print(iteration, current_cost)
 
-    return OptimizationResult(loss=cost)
+    # with shots, the loss curve already counts shots
+    return result
 
-def optimize_adagrad(task: OptimizationTask, debug = False) -> OptimizationResult:
+def optimize_adagrad(task: OptimizationTask, debug = False, callback: Callable[[UpdateEvent], None] = None) -> OptimizationResult:
     max_iterations = ceil(task.max_evaluations / 2) # 2 evals per iteration
     optimizer = qml.AdagradOptimizer()
     params = task.initial_params
+    circuit = _shared_circuit(task)
+    if callback is not None:
+        callback = labelled(callback, _label(task), "Adagrad")
 
-    cost = [(0, float(task.circuit(*task.initial_params)))]
+    result = OptimizationResult(loss=[(0, float(circuit(*task.initial_params)))])
     for iteration in range(max_iterations):
+        started = time.perf_counter()
         with qml.Tracker(task.circuit.device) as tracker:
             params, prev_cost = optimizer.step_and_cost(
-                task.circuit,
+                circuit,
                 *params,
             )
+        evaluated = time.perf_counter()
         evaluations_here = tracker.totals['batches']
-        assert evaluations_here >= 2, "Gradient needs two evaluations!"
-        current_cost = float(task.circuit(*params))
-
-        evaluations_so_far = max([evs for (evs, _) in cost], default=0)
-        cost.append((evaluations_so_far + evaluations_here, current_cost))
+        # with shots, the step is charged by the tracker's shots instead
+        assert task.shots is not None or evaluations_here >= 2, "Gradient needs two evaluations!"
+        current_cost = float(circuit(*params))
+        _report_step(callback, started, evaluated, evaluations_here, prev_cost, current_cost, iteration)
+
+        step_cost = _gradient_step_cost(task, tracker)
+        if task.shots is not None and result.total_evaluations + step_cost > task.max_evaluations * task.shots:
+            if debug: print("budget exhausted", iteration)
+            break
+        result.append(result.total_evaluations + step_cost, current_cost)
 
-        if np.abs(task.circuit(*params) - prev_cost) <= task.convergence_threshold:
+        if np.abs(circuit(*params) - prev_cost) <= task.convergence_threshold:
             if debug: print("abort", iteration)
             break
         if debug and iteration % 20 == 0:
             print(iteration, current_cost)
 
-    return OptimizationResult(loss=cost)
+    # with shots, the loss curve already counts shots
+    return result
 
 Optimizer = Callable[[OptimizationTask], OptimizationResult]
 
@@ -0,0 +1,91 @@
+"""
+Adaptive parameter ordering for Crotosolve sweeps.
+
+After every update, the amplitude of the reconstructed landscape (d3 + d5,
+how much the cost can vary with the parameter) and the achieved improvement
+are kept per parameter. The next sweep visits the parameters in order of
+their last improvement, as an estimate of the gain a new update brings, and
+skips parameters whose landscape was flat or whose last improvement was
+negligible compared to the best one. Every `refresh_every` sweeps, when
+nothing would be visited and after `refresh`, all parameters are visited in
+the default order. Parameters whose spectrum (see `parameters.ParameterInfo`)
+is known to be empty do not change the cost and are never visited.
+"""
+import numpy as np
+from typing import Iterable
+
+from parameters import ParameterInfo
+
+def amplitude(constants: dict) -> float:
+    """
+    Sum of the amplitudes of the frequency components of a reconstruction.
+    """
+    if "coefficients" in constants:
+        coefficients = np.asarray(constants["coefficients"])
+        return float(np.sum(np.hypot(coefficients[1::2], coefficients[2::2])))
+    return abs(float(constants["d3"])) + abs(float(constants["d5"]))
+
+class AdaptiveOrdering:
+    def __init__(
+            self,
+            parameters: Iterable[ParameterInfo],
+            refresh_every: int = 4,
+            flat_tolerance: float = 1e-8,
+            relative_gain: float = 1e-2,
+    ) -> None:
+        """
+        `parameters` are the parameters of a `ParameterRegistry` in the default
+        sweep order. Those to visit are kept as (gate, param_index) pairs.
+        """
+        self.parameters = [info.key for info in parameters if info.spectrum != ()]
+        self.refresh_every = refresh_every
+        self.flat_tolerance = flat_tolerance
+        self.relative_gain = relative_gain
+        self.amplitudes: dict[tuple[str, tuple], float] = {}
+        self.gains: dict[tuple[str, tuple], float] = {}
+        self.sweeps = 0
+        self.full_sweep = True
+        self.visits = list(self.parameters)
+        self.stale = False
+
+    def order(self) -> list[tuple[str, tuple]]:
+        """
+        The parameters to visit in the next sweep, in order. They are kept as
+        `visits`, and `full_sweep` tells whether these are all parameters.
+        """
+        self.sweeps += 1
+        self.full_sweep = True
+        self.visits = list(self.parameters)
+        if len(self.gains) == 0 or self.stale or self.sweeps % self.refresh_every == 0:
+            self.stale = False
+            return self.visits
+
+        # parameters that were never reconstructed (e.g. after the budget ran out) come first
+        unknown = [parameter for parameter in self.parameters if parameter not in self.gains]
+        best = max(self.gains.values())
+        promising = [
+            parameter for parameter in self.parameters
+            if parameter in self.gains
+            and self.amplitudes[parameter] > self.flat_tolerance
+            and self.gains[parameter] > self.relative_gain * best
+        ]
+        promising.sort(key=lambda parameter: (self.gains[parameter], self.amplitudes[parameter]), reverse=True)
+        if len(unknown) + len(promising) == 0:
+            return self.visits
+        self.visits = unknown + promising
+        self.full_sweep = len(self.visits) == len(self.parameters)
+        return self.visits
+
+    def refresh(self) -> None:
+        """
+        Makes the next sweep a full one, e.g. when a partial sweep stalled.
+        """
+        self.stale = True
+
+    def record(self, gate: str, param_index: tuple, constants: dict, before: float, after: float) -> None:
+        """
+        Keeps the amplitude of a parameter's reconstruction and the decrease
+        of the cost from `before` to `after` its update.
+        """
+        self.amplitudes[(gate, param_index)] = amplitude(constants)
+        self.gains[(gate, param_index)] = max(float(before) - float(after), 0.0)
@@ -0,0 +1,164 @@
+"""
+Parameter registry of the `circuits.py` ansatz family.
+
+All parameters of a circuit live in one contiguous float buffer, and the
+`rp_params` and `crp_params` arrays the circuits take are views onto it.
+Univariate evaluations patch a single slot in place and restore it afterwards
+instead of copying a parameter array, and broadcasted ones only copy the
+array of the varied parameter. Every parameter also carries metadata about
+the gates that use it, which `optimizers.py` and `ordering.py` read the sweep
+order and the spectra from.
+"""
+import numpy as np
+from contextlib import contextmanager
+from functools import lru_cache
+from numpy.typing import NDArray
+from typing import Iterator
+
+from circuits import parameter_shapes
+from reconstruction import Spectrum
+from statevector import cached_operations
+from structure import cached_parameter_spectra
+
+class ParameterInfo:
+    """
+    Metadata of one parameter: its gate type ("RP" or "CRP") and index into
+    the corresponding array, the names and wires of the gates that use it,
+    its layer (the first index) and its frequency spectrum.
+    """
+    def __init__(
+            self,
+            gate: str,
+            param_index: tuple,
+            gate_names: list[str] = None,
+            wires: list[list[int]] = None,
+            spectrum: Spectrum = None,
+    ) -> None:
+        self.gate = gate
+        self.param_index = param_index
+        self.gate_names = gate_names or []
+        self.wires = wires or []
+        self.spectrum = spectrum
+
+    @property
+    def key(self) -> tuple[str, tuple]:
+        return self.gate, self.param_index
+
+    @property
+    def layer(self) -> int:
+        return self.param_index[0]
+
+    def __repr__(self) -> str:
+        return f"ParameterInfo({self.gate}{list(self.param_index)}, {self.gate_names} on {self.wires}, spectrum {self.spectrum})"
+
+class ParameterRegistry:
+    """
+    A contiguous buffer holding the RP parameters followed by the CRP
+    parameters, with `rp` and `crp` as views of the circuit's parameter shapes.
+    """
+    def __init__(self, rp_shape: tuple, crp_shape: tuple, infos: dict[tuple[str, tuple], ParameterInfo] = None) -> None:
+        self.rp_shape = tuple(rp_shape)
+        self.crp_shape = tuple(crp_shape)
+        rp_size = int(np.prod(rp_shape))
+        self.buffer = np.zeros(rp_size + int(np.prod(crp_shape)))
+        self.rp = self.buffer[:rp_size].reshape(rp_shape)
+        self.crp = self.buffer[rp_size:].reshape(crp_shape)
+        self.offsets = {"RP": 0, "CRP": rp_size}
+        self.shapes = {"RP": self.rp_shape, "CRP": self.crp_shape}
+        # registries without metadata are cheap to create (one per Crotosolve sweep)
+        self.infos = infos if infos is not None else {}
+
+    @classmethod
+    def from_structure(cls, circuit_id: str, num_qubits: int, num_layers: int) -> "ParameterRegistry":
+        """
+        A registry with the metadata of a circuit structure (see `structure_infos`).
+        """
+        rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+        return cls(rp_shape, crp_shape, structure_infos(circuit_id, num_qubits, num_layers))
+
+    def load(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> "ParameterRegistry":
+        self.rp[...] = rp_params
+        self.crp[...] = crp_params
+        return self
+
+    @property
+    def params(self) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+        return self.rp, self.crp
+
+    def slot(self, gate: str, param_index: tuple) -> int:
+        """
+        Position of a parameter in the buffer.
+        """
+        return self.offsets[gate] + int(np.ravel_multi_index(param_index, self.shapes[gate]))
+
+    def __getitem__(self, key: tuple[str, tuple]) -> float:
+        return self.buffer[self.slot(*key)]
+
+    def __setitem__(self, key: tuple[str, tuple], value: float) -> None:
+        self.buffer[self.slot(*key)] = value
+
+    def __iter__(self) -> Iterator[ParameterInfo]:
+        """
+        The parameters in sweep order (all RP, then all CRP parameters).
+        """
+        for gate, shape in self.shapes.items():
+            for param_index in np.ndindex(shape):
+                yield self.info(gate, param_index)
+
+    def info(self, gate: str, param_index: tuple) -> ParameterInfo:
+        return self.infos.get((gate, param_index)) or ParameterInfo(gate, param_index)
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def spectra(self) -> dict[tuple[str, tuple], Spectrum]:
+        """
+        The spectra of all parameters, keyed by (gate, param_index).
+        """
+        return {info.key: info.spectrum for info in self}
+
+    @contextmanager
+    def patched(self, gate: str, param_index: tuple, value: float):
+        """
+        Sets one parameter for the duration of the context and restores it
+        afterwards, so that the views can be passed to the circuit as they are.
+        """
+        slot = self.slot(gate, param_index)
+        previous = self.buffer[slot]
+        self.buffer[slot] = value
+        try:
+            yield self.params
+        finally:
+            self.buffer[slot] = previous
+
+    def broadcasted(self, gate: str, param_index: tuple, param_values: NDArray[np.float_]) -> tuple[NDArray[np.float_], NDArray[np.float_]]:
+        """
+        Parameter arrays for one broadcasted execution over `param_values`: the
+        array of `gate` is copied with a trailing batch axis along which the
+        parameter takes the values, the other array is passed as its view.
+        """
+        params = self.rp if gate == "RP" else self.crp
+        broadcasted_params = np.repeat(params[..., np.newaxis], len(param_values), axis=-1)
+        broadcasted_params[param_index] = param_values
+        return (broadcasted_params, self.crp) if gate == "RP" else (self.rp, broadcasted_params)
+
+@lru_cache(maxsize=None)
+def structure_infos(circuit_id: str, num_qubits: int, num_layers: int) -> dict[tuple[str, tuple], ParameterInfo]:
+    """
+    The metadata of all parameters of a circuit structure, from its traced
+    operations and parameter spectra. Computed once per process and shared.
+    """
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    spectra = cached_parameter_spectra(circuit_id, num_qubits, num_layers)
+    infos = {
+        (gate, param_index): ParameterInfo(gate, param_index, spectrum=spectra[(gate, param_index)])
+        for gate, shape in [("RP", rp_shape), ("CRP", crp_shape)]
+        for param_index in np.ndindex(shape)
+    }
+    _, operations, _ = cached_operations(circuit_id, num_qubits, num_layers)
+    for operation in operations:
+        if operation.parametrized:
+            info = infos[(operation.gate, operation.param_index)]
+            info.gate_names.append(operation.name)
+            info.wires.append(list(operation.wires))
+    return infos
@@ -0,0 +1,223 @@
+"""
+Profiling of optimization runs.
+
+The optimizers call a `callback` with an `UpdateEvent` after every update:
+Crotosolve and Rotosolve after every parameter update, the gradient
+optimizers after every step. An event reports the evaluations the update
+was charged (for Crotosolve those of the reconstruction, without the cost
+before a sweep) and splits its wall time into circuit evaluation,
+reconstruction, minimization and other work. For the gradient optimizers,
+the whole gradient computation counts as circuit evaluation, since the
+parameter-shift circuits run in autograd's backward pass.
+
+A `ProfileCollector` is such a callback. It aggregates the events per
+circuit structure and optimizer and exports them as JSON or as collapsed
+stacks, the input format of flame graph tools (e.g. `flamegraph.pl` or
+speedscope).
+
+usage: python profiling.py <circuit_id> <num_qubits> <num_layers> [--optimizer NAME] [--max-evaluations N] [--json FILE] [--collapsed FILE]
+"""
+import argparse
+import json
+import time
+import numpy
+import pennylane.numpy as np
+from math import pi
+from typing import Callable
+
+# the parts of an update's wall time, in the order of the collapsed stacks
+phases = ["evaluation", "reconstruction", "minimization", "other"]
+
+class UpdateEvent:
+    """
+    One update of an optimization run. Per-step events of optimizers that
+    update all parameters at once have no `gate` and `param_index`.
+    `circuit` ("<circuit_id>_<qubits>x<layers>") and `optimizer` are set by
+    the `optimize_*` functions.
+    """
+    def __init__(
+            self,
+            gate: str,
+            param_index: tuple,
+            evaluations: int,
+            loss_before: float,
+            loss_after: float,
+            evaluation_seconds: float = 0.0,
+            reconstruction_seconds: float = 0.0,
+            minimization_seconds: float = 0.0,
+            other_seconds: float = 0.0,
+            sweep: int = 0,
+            circuit: str = None,
+            optimizer: str = None,
+    ) -> None:
+        self.gate = gate
+        self.param_index = param_index
+        self.evaluations = evaluations
+        self.loss_before = float(loss_before)
+        self.loss_after = float(loss_after)
+        self.seconds = {
+            "evaluation": evaluation_seconds,
+            "reconstruction": reconstruction_seconds,
+            "minimization": minimization_seconds,
+            "other": other_seconds,
+        }
+        self.sweep = sweep
+        self.circuit = circuit
+        self.optimizer = optimizer
+
+    @property
+    def parameter(self) -> str:
+        if self.gate is None:
+            return "step"
+        return f"{self.gate}[{','.join(str(i) for i in self.param_index)}]"
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.seconds.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "circuit": self.circuit,
+            "optimizer": self.optimizer,
+            "sweep": self.sweep,
+            "parameter": self.parameter,
+            "evaluations": self.evaluations,
+            "loss_before": self.loss_before,
+            "loss_after": self.loss_after,
+            "seconds": dict(self.seconds),
+        }
+
+    def __repr__(self) -> str:
+        return f"UpdateEvent({self.parameter}, {self.evaluations} evaluations, {self.loss_before:.6f} -> {self.loss_after:.6f}, {self.total_seconds:.4f}s)"
+
+class TimedCircuit:
+    """
+    Wraps a circuit and sums the wall time spent in it. With `record_calls`,
+    the (start, end) times of every call are kept in `calls` as well.
+    """
+    def __init__(self, circuit: Callable, record_calls: bool = False) -> None:
+        self.circuit = circuit
+        self.seconds = 0.0
+        self.calls: list[tuple[float, float]] = []
+        self.record_calls = record_calls
+        # lets inspect.signature see the circuit's argument names (RotosolveOptimizer refers to them)
+        self.__wrapped__ = circuit
+
+    def __call__(self, *params):
+        start = time.perf_counter()
+        try:
+            return self.circuit(*params)
+        finally:
+            end = time.perf_counter()
+            self.seconds += end - start
+            if self.record_calls:
+                self.calls.append((start, end))
+
+def labelled(callback: Callable[[UpdateEvent], None], circuit: str, optimizer: str) -> Callable[[UpdateEvent], None]:
+    """
+    A callback that sets the circuit and optimizer of the events before passing them on.
+    """
+    def labelled_callback(event: UpdateEvent) -> None:
+        event.circuit = circuit
+        event.optimizer = optimizer
+        callback(event)
+
+    return labelled_callback
+
+def _empty_profile() -> dict:
+    return {"updates": 0, "evaluations": 0, "loss_decrease": 0.0, "seconds": {phase: 0.0 for phase in phases}}
+
+def _add(profile: dict, event: UpdateEvent) -> None:
+    profile["updates"] += 1
+    profile["evaluations"] += event.evaluations
+    profile["loss_decrease"] += event.loss_before - event.loss_after
+    for phase, seconds in event.seconds.items():
+        profile["seconds"][phase] += seconds
+
+class ProfileCollector:
+    """
+    Collects the events of any number of runs. Can be passed as the
+    `callback` of the optimizers, also from several threads (appending to
+    a list is atomic), but not across processes.
+    """
+    def __init__(self) -> None:
+        self.events: list[UpdateEvent] = []
+
+    def __call__(self, event: UpdateEvent) -> None:
+        self.events.append(event)
+
+    def profiles(self) -> dict:
+        """
+        Totals per circuit and optimizer, and below them per parameter:
+        {circuit: {optimizer: {"updates", "evaluations", "loss_decrease",
+        "seconds": {phase: seconds}, "parameters": {parameter: {...}}}}}
+        """
+        profiles = {}
+        for event in self.events:
+            optimizer_profile = profiles.setdefault(event.circuit or "circuit", {}).setdefault(event.optimizer or "optimizer", {**_empty_profile(), "parameters": {}})
+            _add(optimizer_profile, event)
+            _add(optimizer_profile["parameters"].setdefault(event.parameter, _empty_profile()), event)
+        return profiles
+
+    def collapsed_stacks(self) -> list[str]:
+        """
+        Lines "circuit;optimizer;parameter;phase microseconds", summed over
+        all events of the same stack.
+        """
+        stacks: dict[str, float] = {}
+        for event in self.events:
+            for phase, seconds in event.seconds.items():
+                stack = f"{event.circuit or 'circuit'};{event.optimizer or 'optimizer'};{event.parameter};{phase}"
+                stacks[stack] = stacks.get(stack, 0.0) + seconds
+        return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in stacks.items() if round(seconds * 1e6) > 0]
+
+    def save_json(self, path: str, events: bool = False) -> None:
+        """
+        Writes the profiles, and with `events` also every single event.
+        """
+        content = {"profiles": self.profiles()}
+        if events:
+            content["events"] = [event.to_dict() for event in self.events]
+        with open(path, "w") as file:
+            json.dump(content, file, indent=2)
+
+    def save_collapsed(self, path: str) -> None:
+        with open(path, "w") as file:
+            file.write("\n".join(self.collapsed_stacks()) + "\n")
+
+    def summary(self) -> str:
+        lines = []
+        for circuit, optimizer_profiles in self.profiles().items():
+            for optimizer, profile in optimizer_profiles.items():
+                total = sum(profile["seconds"].values())
+                shares = ", ".join(f"{phase} {seconds / total:.0%}" for phase, seconds in profile["seconds"].items()) if total > 0 else "no time"
+                lines.append(f"{circuit} {optimizer}: {profile['updates']} updates, {profile['evaluations']} evaluations, {total:.3f}s ({shares})")
+        return "\n".join(lines)
+
+if __name__ == "__main__":
+    from circuits import parameter_shapes
+    from optimizers import OptimizationTask, optimizers
+
+    parser = argparse.ArgumentParser(description="Profiles one optimization run from random initial parameters.")
+    parser.add_argument("circuit_id")
+    parser.add_argument("num_qubits", type=int)
+    parser.add_argument("num_layers", type=int)
+    parser.add_argument("--optimizer", default="Crotosolve", choices=[name for name, _ in optimizers])
+    parser.add_argument("--max-evaluations", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="where to write the profiles and events as JSON")
+    parser.add_argument("--collapsed", default=None, help="where to write the collapsed stacks for flame graphs")
+    args = parser.parse_args()
+
+    rp_shape, crp_shape = parameter_shapes(args.circuit_id, args.num_qubits, args.num_layers)
+    rng = numpy.random.default_rng(args.seed)
+    initial_params = (np.array(rng.random(rp_shape) * 2 * pi), np.array(rng.random(crp_shape) * 4 * pi))
+    task = OptimizationTask(args.circuit_id, args.num_qubits, args.num_layers, initial_params, max_evaluations=args.max_evaluations)
+
+    collector = ProfileCollector()
+    dict(optimizers)[args.optimizer](task, callback=collector)
+    print(collector.summary())
+    if args.json is not None:
+        collector.save_json(args.json, events=True)
+    if args.collapsed is not None:
+        collector.save_collapsed(args.collapsed)
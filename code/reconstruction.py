@@ -1,140 +1,311 @@
 import math
+from fractions import Fraction
+from functools import lru_cache
 from math import pi
 import numpy as np
+from numpy.typing import ArrayLike, NDArray
 
-def reconstruct_rp(original_function, theta: float, value_at_theta: float, debug = False):
-    # measure function at three chosen points
-    y_0 = value_at_theta # cached result of original_function(theta + 0)
-    y_pi = original_function(theta + pi)
-    y_32pi = original_function(theta + (3/2) * pi)
+# offsets of the sampled points relative to theta
+rp_shifts = np.array([0, 1, 3/2]) * pi
+crp_shifts = np.array([0, 1, 3/2, 2, 3, 7/2]) * pi
 
-    d1 = (1/2) * (y_0 + y_pi)
+def _sample(original_function, theta: float, value_at_theta: float, shifts: NDArray[np.float_], batched: bool) -> NDArray[np.float_]:
+    """
+    The function values at `theta + shifts`, where the first shift is 0 and
+    its value is the cached `value_at_theta`.
+    """
+    if batched:
+        # original_function accepts a vector of angles and evaluates them in one go
+        samples = original_function(theta + shifts[1:])
+    else:
+        samples = [original_function(theta + shift) for shift in shifts[1:]]
+    return np.array([value_at_theta, *(float(sample) for sample in samples)], dtype=float)
 
-    y2_0 = y_0 - d1
-    y2_pi = y_pi - d1
-    y2_32pi = y_32pi - d1
+def _reconstruction(d1: float, d2: float, d3: float, d4: float, d5: float):
+    """
+    f(x) = d1 + d3 cos(x/2 + d2) + d5 cos(x + d4) and its two terms as functions of a single angle.
+    """
+    def reconstructed_y1(theta):
+        return d3 * math.cos(theta / 2 + d2)
 
-    if y2_0 == 0 and y2_32pi == 0:
-        d4 = 0 # arbitrary choice
-        d5 = 0
-    elif y2_0 == 0 and y2_32pi != 0:
-        d4 = (1/2) * pi - theta
-        d5 = y2_32pi
-    else:
-        d4 = math.atan(y2_32pi / y2_0) - theta
-        d5 = y2_0 / math.cos(theta + d4)
+    def reconstructed_y2(theta):
+        return d5 * math.cos(theta + d4)
 
     def reconstructed_function(theta):
-        return d1 + d5 * math.cos(theta + d4)
-    
-    if abs(d5) > 1:
-        print(f"alarm alarm! {(0.0, float(y_0 - d1))}, {(pi, float(y_pi - d1))}, {(1.5 * pi, float(y_32pi - d1))} // d4={d4}, d5={d5}")
+        return d1 + reconstructed_y1(theta) + reconstructed_y2(theta)
+
+    return reconstructed_function, reconstructed_y1, reconstructed_y2
 
+def _scalar_reconstruction(constants: dict[str, NDArray[np.float_]], theta: float, samples: NDArray[np.float_], shifts: NDArray[np.float_]):
+    """
+    Wraps the constants of a single parameter (as returned by the vectorized
+    `reconstruct_*_constants`) into a reconstruction and its constants dict.
+    """
+    d1, d2, d3, d4, d5 = (float(constants[d]) for d in ("d1", "d2", "d3", "d4", "d5"))
+    reconstructed_function, reconstructed_y1, reconstructed_y2 = _reconstruction(d1, d2, d3, d4, d5)
     return reconstructed_function, {
         "d1": d1,
-        "d2": 0,
-        "d3": 0,
+        "d2": d2,
+        "d3": d3,
         "d4": d4,
         "d5": d5,
-        "y1": lambda _: 0,
-        "y2": lambda theta: reconstructed_function(theta) - d1,
-        "points": [
-            (theta,                 y_0),
-            (theta + pi,            y_pi),
-            (theta + (3/2) * pi,    y_32pi)
-        ]
+        "evaluations": len(shifts) - 1,
+        "y1": reconstructed_y1,
+        "y2": reconstructed_y2,
+        "points": list(zip((theta + shifts).tolist(), samples.tolist())),
     }
 
-def reconstruct_crp(original_function, theta: float, value_at_theta: float, debug = False):
+def reconstruct_rp(original_function, theta: float, value_at_theta: float, debug = False, batched = False):
     """
-    Reconstructs a function f(x) = a + b cos(x + c) + d cos(x/2 + e) given as
-    the `original_function` using six targeted evaluations.
-    Returns the reconstruction of f.
+    Reconstructs a function f(x) = a + b cos(x + c) given as the
+    `original_function` using three targeted evaluations (see `reconstruct_rp_constants`).
     """
+    samples = _sample(original_function, theta, value_at_theta, rp_shifts, batched)
+    if debug: print(f"samples {list(zip(theta + rp_shifts, samples))}")
+    constants = reconstruct_rp_constants(samples, theta)
+
+    if abs(constants["d5"]) > 1:
+        print(f"alarm alarm! {', '.join(str(point) for point in zip(rp_shifts.tolist(), (samples - constants['d1']).tolist()))} // d4={constants['d4']}, d5={constants['d5']}")
 
-    # measure function at six chosen points
-    y_0 = value_at_theta # cached result of original_function(theta + 0)
-    if debug: print(f"y_0={y_0}")
+    return _scalar_reconstruction(constants, theta, samples, rp_shifts)
 
-    y_pi = original_function(theta + pi)
-    if debug: print(f"y_pi={y_pi}")
+def reconstruct_crp(original_function, theta: float, value_at_theta: float, debug = False, batched = False):
+    """
+    Reconstructs a function f(x) = a + b cos(x + c) + d cos(x/2 + e) given as
+    the `original_function` using six targeted evaluations (see `reconstruct_crp_constants`).
+    If `batched` is set, `original_function` is called once with a vector of
+    all five shifted angles instead of five times with a single angle.
+    Returns the reconstruction of f.
+    """
+    samples = _sample(original_function, theta, value_at_theta, crp_shifts, batched)
+    if debug: print(f"samples {list(zip(theta + crp_shifts, samples))}")
+    constants = reconstruct_crp_constants(samples, theta)
+    if debug: print("\n".join(f"{d}={float(value)}" for d, value in constants.items()))
 
-    y_32pi = original_function(theta + 3 / 2 * pi)
-    if debug: print(f"y_3/2pi={y_32pi}")
+    return _scalar_reconstruction(constants, theta, samples, crp_shifts)
 
-    y_2pi = original_function(theta + 2 * pi)
-    if debug: print(f"y_2pi={y_2pi}")
+def reconstruct_rp_constants(samples: ArrayLike, theta: ArrayLike) -> dict[str, NDArray[np.float_]]:
+    """
+    Vectorized counterpart of `reconstruct_rp`: `samples[..., i]` is the
+    function value at `theta + rp_shifts[i]`. Returns the constants d1..d5
+    as arrays of shape `theta.shape`.
+    """
+    samples = np.asarray(samples, dtype=float)
+    theta = np.asarray(theta, dtype=float)
+    y_0, y_pi, y_32pi = np.moveaxis(samples, -1, 0)
 
-    y_3pi = original_function(theta + 3 * pi)
-    if debug: print(f"y_3pi={y_3pi}")
+    d1 = (1/2) * (y_0 + y_pi)
+    # y2(theta) = d5 cos(theta + d4) and y2(theta + 3/2 pi) = d5 sin(theta + d4)
+    d4 = np.arctan2(y_32pi - d1, y_0 - d1) - theta
+    d5 = np.hypot(y_32pi - d1, y_0 - d1)
 
-    y_72pi = original_function(theta + 7 / 2 * pi)
-    if debug: print(f"y_7/2pi={y_72pi}\n")
+    zeros = np.zeros_like(d1)
+    return {"d1": d1, "d2": zeros, "d3": zeros, "d4": d4, "d5": d5}
 
+def reconstruct_crp_constants(samples: ArrayLike, theta: ArrayLike) -> dict[str, NDArray[np.float_]]:
+    """
+    Vectorized counterpart of `reconstruct_crp`: `samples[..., i]` is the
+    function value at `theta + crp_shifts[i]`. Returns the constants d1..d5
+    as arrays of shape `theta.shape`.
+    """
+    samples = np.asarray(samples, dtype=float)
+    theta = np.asarray(theta, dtype=float)
+    y_0, y_pi, y_32pi, y_2pi, y_3pi, y_72pi = np.moveaxis(samples, -1, 0)
 
-    # determine reconstruction constants from these measurements
     d1 = (1/4) * (y_0 + y_2pi + y_pi + y_3pi)
-    if debug: print(f"d_1={d1}")
 
+    # y1(theta) = d3 cos(theta/2 + d2) and y1(theta + 3pi) = d3 sin(theta/2 + d2)
     y1_0 = (1/2) * (y_0 - y_2pi)
     y1_3pi = (1/2) * (y_3pi - y_pi)
-    if y1_0 == 0 and y1_3pi == 0:
-        d2 = 0 # arbitrary choice
-        d3 = 0
-    elif y1_0 == 0 and y1_3pi != 0:
-        d2 = (1/2) * pi - theta / 2
-        d3 = y1_3pi
-    else:
-        d2 = math.atan(y1_3pi / y1_0) - theta / 2
-        d3 = y1_0 / math.cos(theta / 2 + d2)
-    if debug: print(f"d_2={d2}\nd_3={d3}")
+    d2 = np.arctan2(y1_3pi, y1_0) - theta / 2
+    d3 = np.hypot(y1_3pi, y1_0)
 
+    # y2(theta) = d5 cos(theta + d4) and y2(theta + 3/2 pi) = d5 sin(theta + d4)
     y2_0 = (1/2) * (y_0 + y_2pi - 2 * d1)
     y2_32pi = (1/2) * (y_32pi + y_72pi - 2 * d1)
-    if y2_0 == 0 and y2_32pi == 0:
-        d4 = 0 # arbitrary choice
-        d5 = 0
-    elif y2_0 == 0 and y2_32pi != 0:
-        d4 = (1/2) * pi - theta
-        d5 = y2_32pi
+    d4 = np.arctan2(y2_32pi, y2_0) - theta
+    d5 = np.hypot(y2_32pi, y2_0)
+
+    return {"d1": d1, "d2": d2, "d3": d3, "d4": d4, "d5": d5}
+
+def reconstruct_constants(samples: ArrayLike, theta: ArrayLike, gate: str = "CRP") -> dict[str, NDArray[np.float_]]:
+    """
+    `reconstruct_rp_constants` or `reconstruct_crp_constants`, depending on `gate`.
+    """
+    if gate == "RP":
+        return reconstruct_rp_constants(samples, theta)
+    elif gate == "CRP":
+        return reconstruct_crp_constants(samples, theta)
     else:
-        d4 = math.atan(y2_32pi / y2_0) - theta
-        d5 = y2_0 / math.cos(theta + d4)
-    if debug: print(f"d_4={d4}\nd_5={d5}\n")
+        raise ValueError("unrecognized gate, pass its spectrum instead!", gate)
+
+def reconstruct_exact(coefficients: tuple, theta: float, value_at_theta: float, debug = False, gate = "CRP"):
+    """
+    Builds the reconstruction from the exact Fourier coefficients
+    (a0, a_half, b_half, a1, b1) of f(x) = a0 + a_half cos(x/2) + b_half sin(x/2) + a1 cos(x) + b1 sin(x),
+    e.g. as computed by `StatevectorEngine.fourier_coefficients`.
+    No circuit is evaluated, but "evaluations" reports the number of evaluations
+    the sampled reconstruction would have used, so loss curves stay comparable.
+    """
+    a0, a_half, b_half, a1, b1 = coefficients
 
+    d1 = a0
+    d2 = math.atan2(-b_half, a_half)
+    d3 = math.hypot(a_half, b_half)
+    d4 = math.atan2(-b1, a1)
+    d5 = math.hypot(a1, b1)
+    if debug: print(f"d_1={d1}\nd_2={d2}\nd_3={d3}\nd_4={d4}\nd_5={d5}\n")
 
-    # and finally, reconstruct the cost function
-    def reconstructed_y1(theta):
-        return d3 * math.cos(theta / 2 + d2)
-    
-    def reconstructed_y2(theta):
-        return d5 * math.cos(theta + d4)
+    reconstructed_function, reconstructed_y1, reconstructed_y2 = _reconstruction(d1, d2, d3, d4, d5)
 
-    def reconstructed_function(theta):
-        return d1 + reconstructed_y1(theta) + reconstructed_y2(theta)
-    
     return reconstructed_function, {
         "d1": d1,
         "d2": d2,
         "d3": d3,
         "d4": d4,
         "d5": d5,
+        "evaluations": 2 if gate == "RP" else 5,
         "y1": reconstructed_y1,
         "y2": reconstructed_y2,
         "points": [
-            (theta,                 y_0),
-            (theta + pi,            y_pi),
-            (theta + (3/2) * pi,    y_32pi),
-            (theta + 2 * pi,        y_2pi),
-            (theta + 3 * pi,        y_3pi),
-            (theta + (7/2) * pi,    y_72pi)
+            (theta,                 value_at_theta)
         ]
     }
 
-def reconstruct(original_function, theta: float, value_at_theta: float, debug = False, gate = "CRP"):
+def least_squares_shifts(gate: str, num_points: int = None) -> NDArray[np.float_]:
+    """
+    Equidistant sample offsets over one period of the univariate cost, by
+    default twice as many as the reconstruction has unknowns (minus one).
+    """
+    if gate == "RP":
+        return np.arange(num_points or 5) * 2 * pi / (num_points or 5)
+    return np.arange(num_points or 9) * 4 * pi / (num_points or 9)
+
+def reconstruct_least_squares(original_function, theta: float, shifts: NDArray[np.float_], debug = False, gate = "CRP", batched = False):
+    """
+    Fits f(x) = a0 + a_half cos(x/2) + b_half sin(x/2) + a1 cos(x) + b1 sin(x)
+    (without the x/2 terms for RP) to samples at `theta + shifts` in the
+    least-squares sense, so that noisy (finite-shot) samples are averaged
+    instead of interpolated. All samples are evaluated, none is reused.
+    """
+    xs = theta + np.asarray(shifts, dtype=float)
+    if batched:
+        ys = np.asarray(original_function(xs), dtype=float)
+    else:
+        ys = np.array([float(original_function(x)) for x in xs])
+
+    frequencies = [1] if gate == "RP" else [1/2, 1]
+    design = np.stack([np.ones_like(xs)] + [f(w * xs) for w in frequencies for f in (np.cos, np.sin)], axis=1)
+    fitted, *_ = np.linalg.lstsq(design, ys, rcond=None)
+    coefficients = (fitted[0], 0.0, 0.0, fitted[1], fitted[2]) if gate == "RP" else tuple(fitted)
+    if debug: print(f"least squares fit {coefficients} to {list(zip(xs, ys))}")
+
+    reconstructed_function, constants = reconstruct_exact(coefficients, theta, value_at_theta=None, debug=debug, gate=gate)
+    constants["evaluations"] = len(xs)
+    # the samples are noisy, so the minimum is not checked against them but against the fit
+    constants["points"] = [(x, reconstructed_function(x)) for x in xs]
+    return reconstructed_function, constants
+
+# positive frequencies of a parameter in the cost, e.g. (1/2, 1) for a controlled rotation
+Spectrum = tuple[float, ...]
+
+gate_spectra: dict[str, Spectrum] = {"RP": (1.0,), "CRP": (0.5, 1.0)}
+
+def base_frequency(spectrum: Spectrum) -> tuple[float, tuple[int, ...]]:
+    """
+    The largest frequency that all frequencies of `spectrum` are integer
+    multiples of, and these multiples.
+    """
+    if len(spectrum) == 0:
+        return 1.0, ()
+    fractions = [Fraction(frequency).limit_denominator(1000) for frequency in spectrum]
+    numerator = math.gcd(*(fraction.numerator for fraction in fractions))
+    denominator = math.lcm(*(fraction.denominator for fraction in fractions))
+    base = Fraction(numerator, denominator)
+    return float(base), tuple(int(fraction / base) for fraction in fractions)
+
+def spectrum_shifts(spectrum: Spectrum) -> NDArray[np.float_]:
+    """
+    2R+1 equidistant sample offsets over one period of a cost with the given
+    spectrum, where R is the largest frequency in units of the base frequency.
+    The first offset is 0, so the value at the current parameter can be reused.
+    An empty spectrum (the cost does not depend on the parameter) needs no other samples.
+    """
+    if len(spectrum) == 0:
+        return np.zeros(1)
+    base, multiples = base_frequency(spectrum)
+    num_points = 2 * max(multiples) + 1
+    return np.arange(num_points) * 2 * pi / (base * num_points)
+
+@lru_cache(maxsize=None)
+def _inverse_design_matrix(spectrum: Spectrum, shifts: tuple[float, ...]) -> NDArray[np.float_]:
+    design = np.ones((len(shifts), 1 + 2 * len(spectrum)))
+    for column, frequency in enumerate(spectrum):
+        design[:, 1 + 2 * column] = np.cos(frequency * np.array(shifts))
+        design[:, 2 + 2 * column] = np.sin(frequency * np.array(shifts))
+    inverse = np.linalg.pinv(design)
+    inverse.setflags(write=False)
+    return inverse
+
+def spectrum_coefficients(samples: ArrayLike, spectrum: Spectrum, shifts: ArrayLike = None) -> NDArray[np.float_]:
+    """
+    Fourier coefficients (a0, a_1, b_1, ..., a_K, b_K) of
+    f(theta + s) = a0 + sum_k a_k cos(w_k s) + b_k sin(w_k s)
+    for the frequencies w_k of `spectrum`, given `samples[..., i]` at
+    `theta + shifts[i]` (default: `spectrum_shifts(spectrum)`).
+    The coefficients are relative to theta, so the linear map from samples to
+    coefficients only depends on the spectrum and the shifts. It is computed
+    once and applied as a matrix product. More samples than coefficients give
+    the least-squares fit.
+    """
+    spectrum = tuple(float(frequency) for frequency in spectrum)
+    shifts = spectrum_shifts(spectrum) if shifts is None else shifts
+    inverse = _inverse_design_matrix(spectrum, tuple(float(shift) for shift in shifts))
+    return np.asarray(samples, dtype=float) @ inverse.T
+
+def reconstruct_spectrum(original_function, theta: float, value_at_theta: float, spectrum: Spectrum, debug = False, batched = False):
+    """
+    Reconstructs a univariate cost with an arbitrary (finite) `spectrum` from
+    samples at `theta + spectrum_shifts(spectrum)`, reusing `value_at_theta`
+    for the first of them. For the spectra of `gate_spectra` this needs fewer
+    or as many evaluations as `reconstruct_rp`/`reconstruct_crp`, but gives
+    a different loss curve, since the samples are placed differently.
+    """
+    spectrum = tuple(float(frequency) for frequency in spectrum)
+    shifts = spectrum_shifts(spectrum)
+    if batched:
+        samples = np.asarray(original_function(theta + shifts[1:]), dtype=float)
+    else:
+        samples = np.array([float(original_function(theta + shift)) for shift in shifts[1:]])
+    samples = np.concatenate([[float(value_at_theta)], samples])
+    if debug: print(f"samples {list(zip(theta + shifts, samples))}")
+
+    coefficients = spectrum_coefficients(samples, spectrum, shifts)
+    if debug: print(f"coefficients {coefficients}")
+    frequencies = np.array(spectrum)
+
+    def reconstructed_function(x):
+        s = frequencies * (x - theta)
+        return coefficients[0] + coefficients[1::2] @ np.cos(s) + coefficients[2::2] @ np.sin(s)
+
+    return reconstructed_function, {
+        "theta": theta,
+        "spectrum": spectrum,
+        "coefficients": coefficients,
+        "evaluations": len(shifts) - 1,
+        "points": list(zip(theta + shifts, samples)),
+    }
+
+def reconstruct(original_function, theta: float, value_at_theta: float, debug = False, gate = "CRP", batched = False, spectrum: Spectrum = None):
+    """
+    Reconstructs the univariate cost of a parameter, from its `spectrum` if
+    given and otherwise with the hand-derived reconstruction of its `gate`.
+    """
+    if spectrum is not None:
+        return reconstruct_spectrum(original_function, theta, value_at_theta, spectrum, debug, batched)
     if gate == "RP":
-        return reconstruct_rp(original_function, theta, value_at_theta, debug)
+        return reconstruct_rp(original_function, theta, value_at_theta, debug, batched)
     elif gate == "CRP":
-        return reconstruct_crp(original_function, theta, value_at_theta, debug)
+        return reconstruct_crp(original_function, theta, value_at_theta, debug, batched)
     else:
-        raise ValueError("unrecognized gate!", gate)
+        raise ValueError("unrecognized gate, pass its spectrum instead!", gate)
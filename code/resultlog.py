@@ -0,0 +1,188 @@
+"""
+Append-only log of finished (task, optimizer) results.
+
+Every worker process appends its results to its own segment file in the log
+folder, so results go to disk in the worker, and the parent only gets a
+small notice of where a record is. A record is
+
+    length (4 bytes) | crc32 of the payload (4 bytes) | payload
+
+where the payload holds the length of a JSON header, the header (task and
+optimizer metadata) and the loss curve as raw little-endian int64
+evaluations and float64 values. A record that was cut off or does not match
+its checksum is detected when reading, and it and everything after it in its
+segment are ignored.
+
+`ResultLog.compact` merges all segments into one, keeping the first valid
+record of every (task, optimizer) pair.
+
+usage: python resultlog.py compact <log folder>
+       python resultlog.py check <log folder>
+"""
+import argparse
+import json
+import os
+import struct
+import zlib
+import numpy as np
+from typing import Iterator
+from uuid import uuid4
+
+from results import OptimizationResult
+
+segment_suffix = ".segment"
+_record_header = struct.Struct("!II")
+_json_length = struct.Struct("!I")
+
+def encode_record(meta: dict, result: OptimizationResult) -> bytes:
+    header = json.dumps({**meta, "length": len(result)}).encode()
+    payload = b"".join([
+        _json_length.pack(len(header)),
+        header,
+        result.evaluations.astype("<i8").tobytes(),
+        result.values.astype("<f8").tobytes(),
+    ])
+    return _record_header.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode_payload(payload: bytes) -> tuple[dict, OptimizationResult]:
+    header_length, = _json_length.unpack_from(payload)
+    start = _json_length.size + header_length
+    meta = json.loads(payload[_json_length.size:start])
+    length = meta.pop("length")
+    evaluations = np.frombuffer(payload, dtype="<i8", count=length, offset=start).astype(np.int64)
+    values = np.frombuffer(payload, dtype="<f8", count=length, offset=start + 8 * length).astype(np.float64)
+    return meta, OptimizationResult.from_arrays(evaluations, values)
+
+def read_segment(path: str) -> Iterator[tuple[int, dict, OptimizationResult]]:
+    """
+    Yields the offset, metadata and loss curve of every valid record of a
+    segment, up to the first truncated or corrupted one.
+    """
+    with open(path, "rb") as file:
+        content = file.read()
+    offset = 0
+    while offset < len(content):
+        if offset + _record_header.size > len(content):
+            print(f"Truncated record header at {offset} in {path}!")
+            return
+        length, checksum = _record_header.unpack_from(content, offset)
+        payload = content[offset + _record_header.size:offset + _record_header.size + length]
+        if len(payload) < length:
+            print(f"Truncated record at {offset} in {path}!")
+            return
+        if zlib.crc32(payload) != checksum:
+            print(f"Checksum mismatch of the record at {offset} in {path}!")
+            return
+        meta, result = decode_payload(payload)
+        yield offset, meta, result
+        offset += _record_header.size + length
+
+def read_record(path: str, offset: int) -> tuple[dict, OptimizationResult]:
+    with open(path, "rb") as file:
+        file.seek(offset)
+        header = file.read(_record_header.size)
+        length, checksum = _record_header.unpack(header)
+        payload = file.read(length)
+    if len(payload) < length or zlib.crc32(payload) != checksum:
+        raise ValueError(f"corrupted record at {offset} in {path}")
+    return decode_payload(payload)
+
+class SegmentWriter:
+    """
+    Appends records to a new segment of a log folder. Every record is
+    flushed and synced before `append` returns its offset.
+    """
+    def __init__(self, folder: str) -> None:
+        os.makedirs(folder, exist_ok=True)
+        # a new segment per writer, so that a torn record of an earlier run cannot hide later records
+        self.name = f"{os.getpid()}-{uuid4().hex[:12]}{segment_suffix}"
+        self.path = os.path.join(folder, self.name)
+        self.file = open(self.path, "ab")
+
+    def append(self, meta: dict, result: OptimizationResult) -> int:
+        offset = self.file.tell()
+        self.file.write(encode_record(meta, result))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return offset
+
+    def close(self) -> None:
+        self.file.close()
+
+# one writer per process and log folder, see `worker_writer`
+_writers: dict[str, SegmentWriter] = {}
+
+def worker_writer(folder: str) -> SegmentWriter:
+    """
+    The segment writer of the current (worker) process.
+    """
+    if folder not in _writers:
+        _writers[folder] = SegmentWriter(folder)
+    return _writers[folder]
+
+class ResultLog:
+    """
+    Index of the valid records of all segments in a log folder, keyed by
+    (task uuid, optimizer) and pointing to (segment name, offset).
+    """
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.index: dict[tuple[str, str], tuple[str, int]] = {}
+        self.metadata: dict[tuple[str, str], dict] = {}
+        os.makedirs(folder, exist_ok=True)
+        for name in self.segments():
+            for offset, meta, _ in read_segment(os.path.join(folder, name)):
+                self.add(name, offset, meta)
+
+    def segments(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.folder) if name.endswith(segment_suffix))
+
+    def add(self, segment: str, offset: int, meta: dict) -> None:
+        """
+        Indexes a record, e.g. from a worker's notice. The first record of a pair wins.
+        """
+        key = (meta["uuid"], meta["optimizer"])
+        if key not in self.index:
+            self.index[key] = (segment, offset)
+            self.metadata[key] = meta
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def read(self, uuid: str, optimizer: str) -> OptimizationResult:
+        segment, offset = self.index[(uuid, optimizer)]
+        _, result = read_record(os.path.join(self.folder, segment), offset)
+        return result
+
+    def compact(self) -> str:
+        """
+        Rewrites all indexed records into one new segment and removes the old
+        segments. Must not run while workers append to the log. Returns the
+        name of the new segment.
+        """
+        old_segments = self.segments()
+        writer = SegmentWriter(self.folder)
+        index = {}
+        for key, (segment, offset) in sorted(self.index.items(), key=lambda entry: entry[1]):
+            meta, result = read_record(os.path.join(self.folder, segment), offset)
+            index[key] = (writer.name, writer.append(meta, result))
+        writer.close()
+        for name in old_segments:
+            os.remove(os.path.join(self.folder, name))
+        self.index = index
+        return writer.name
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compacts or checks a result log.")
+    parser.add_argument("command", choices=["compact", "check"])
+    parser.add_argument("folder", help="log folder, e.g. dataset/.log")
+    args = parser.parse_args()
+
+    log = ResultLog(args.folder)
+    segments = log.segments()
+    print(f"{len(log)} records in {len(segments)} segments.")
+    if args.command == "compact":
+        print(f"Compacted into {log.compact()}.")
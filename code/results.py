@@ -0,0 +1,117 @@
+from __future__ import annotations
+import numpy as np
+from numpy.typing import NDArray
+
+class OptimizationResult:
+    """
+    Loss curve of one optimization run: the loss after every update together
+    with the number of circuit evaluations used up to then (non-decreasing).
+    Stored in growable arrays, so appending is amortized O(1).
+    """
+    __slots__ = ("_evaluations", "_values", "_size")
+
+    def __init__(self, loss: list[tuple[int, float]] = None, capacity: int = 64) -> None:
+        loss = [] if loss is None else list(loss)
+        capacity = max(capacity, len(loss), 1)
+        self._evaluations = np.zeros(capacity, dtype=np.int64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._size = 0
+        for evaluations, value in loss:
+            self.append(evaluations, value)
+
+    @classmethod
+    def from_arrays(cls, evaluations: NDArray[np.int64], values: NDArray[np.float_]) -> OptimizationResult:
+        """
+        Wraps existing arrays without copying them (they are only copied once
+        the result grows), e.g. memory-mapped curves of an archive.
+        """
+        assert len(evaluations) == len(values)
+        result = cls.__new__(cls)
+        result._evaluations = evaluations
+        result._values = values
+        result._size = len(evaluations)
+        return result
+
+    def append(self, evaluations: int, loss: float) -> None:
+        """
+        Appends the loss after an update that brought the evaluation count to `evaluations`.
+        """
+        assert evaluations >= self.total_evaluations, "evaluations must not decrease"
+        if self._size == len(self._evaluations):
+            self._grow()
+        self._evaluations[self._size] = evaluations
+        self._values[self._size] = loss
+        self._size += 1
+
+    def _grow(self) -> None:
+        capacity = max(2 * len(self._evaluations), 1)
+        evaluations = np.zeros(capacity, dtype=np.int64)
+        values = np.zeros(capacity, dtype=np.float64)
+        evaluations[:self._size] = self._evaluations[:self._size]
+        values[:self._size] = self._values[:self._size]
+        self._evaluations, self._values = evaluations, values
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def evaluations(self) -> NDArray[np.int64]:
+        return self._evaluations[:self._size]
+
+    @property
+    def values(self) -> NDArray[np.float_]:
+        return self._values[:self._size]
+
+    @property
+    def total_evaluations(self) -> int:
+        """
+        Number of evaluations used so far (0 for an empty curve).
+        """
+        return int(self._evaluations[self._size - 1]) if self._size > 0 else 0
+
+    @property
+    def loss(self) -> list[tuple[int, float]]:
+        """
+        The curve as a list of `(evaluations, loss)` tuples, as it used to be stored.
+        """
+        return list(zip(self.evaluations.tolist(), self.values.tolist()))
+
+    def loss_at(self, evaluations: int) -> float:
+        """
+        Loss after the last update that used at most `evaluations` evaluations
+        (the first loss value if there was no such update).
+        """
+        assert self._size > 0, "empty loss curve"
+        index = np.searchsorted(self.evaluations, evaluations, side="right") - 1
+        return float(self._values[max(index, 0)])
+
+    def best_so_far(self) -> NDArray[np.float_]:
+        """
+        Lowest loss seen up to each entry of the curve.
+        """
+        return np.minimum.accumulate(self.values)
+
+    def evaluations_to_reach(self, target: float) -> int | None:
+        """
+        Evaluations needed until the loss was at most `target`, None if it never was.
+        """
+        reached = np.flatnonzero(self.values <= target)
+        return int(self._evaluations[reached[0]]) if len(reached) > 0 else None
+
+    def __getstate__(self) -> tuple[str, bytes, bytes]:
+        # raw bytes with the smallest integer type for the evaluations, which
+        # pickles smaller than arrays or the old list of tuples
+        dtype = np.min_scalar_type(self.total_evaluations)
+        return (dtype.str, self.evaluations.astype(dtype).tobytes(), self.values.tobytes())
+
+    def __setstate__(self, state: tuple[str, bytes, bytes] | dict) -> None:
+        if isinstance(state, dict):
+            # instances pickled before the curves were stored in arrays
+            loss = np.asarray(state["loss"], dtype=float).reshape(-1, 2)
+            self._evaluations = loss[:, 0].astype(np.int64)
+            self._values = loss[:, 1].copy()
+        else:
+            dtype, evaluations, values = state
+            self._evaluations = np.frombuffer(evaluations, dtype=dtype).astype(np.int64)
+            self._values = np.frombuffer(values, dtype=np.float64).copy()
+        self._size = len(self._evaluations)
@@ -0,0 +1,333 @@
+"""
+Resumable experiment runner.
+
+A sweep is described by a JSON spec (circuits x sizes x seeds x optimizers,
+see `sweeps/thesis.json`). Every (task, optimizer) pair is one unit of work.
+Workers append the loss curves of finished pairs to their segments of the
+result log (see `resultlog.py`) and only send back where they wrote them.
+Finished pairs are appended to a journal, and once all optimizers of a task
+are done, the task is saved as an `.instance` file. When a sweep is restarted,
+tasks that have an instance file are skipped, and so are pairs that are
+already in the journal (and whose records are intact) or in the log. At the end of a sweep, the log is compacted.
+
+Pairs are dispatched longest-first in chunks of the same circuit structure
+(see `scheduler.py`), using the durations in the journal to predict their cost.
+
+usage: python runner.py <sweep spec> [--workers N] [--max-in-flight N] [--in-order]
+"""
+import argparse
+import json
+import os
+import time
+import pennylane.numpy as np
+import numpy
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from math import pi
+from typing import Iterator
+from uuid import UUID, uuid5
+
+from circuits import parameter_shapes
+from dataset import Instance
+from optimizers import OptimizationTask, Optimizer, optimizers
+from results import OptimizationResult
+from resultlog import ResultLog, worker_writer
+from scheduler import CostModel, affinity_chunks, makespan
+
+# namespace of the task uuids, so the same spec entry always gets the same uuid
+task_namespace = UUID("5d0c5b8e-8f3a-4a53-9a43-2f6e4c1d8b7a")
+
+class TaskKey:
+    """
+    Everything needed to (re)generate a task deterministically.
+    """
+    def __init__(
+            self,
+            circuit_id: str,
+            num_qubits: int,
+            num_layers: int,
+            seed: int,
+            max_evaluations: int,
+            convergence_threshold: float,
+            shots: int = None,
+    ) -> None:
+        self.circuit_id = circuit_id
+        self.num_qubits = num_qubits
+        self.num_layers = num_layers
+        self.seed = seed
+        self.max_evaluations = max_evaluations
+        self.convergence_threshold = convergence_threshold
+        self.shots = shots
+        name = f"{circuit_id}_{num_qubits}x{num_layers}_{seed}_{max_evaluations}_{convergence_threshold!r}"
+        # analytic tasks keep the uuids they had before shots were supported
+        if shots is not None:
+            name += f"_{shots}shots"
+        self.uuid = uuid5(task_namespace, name)
+
+    def task(self) -> OptimizationTask:
+        rp_shape, crp_shape = parameter_shapes(self.circuit_id, self.num_qubits, self.num_layers)
+        rng = numpy.random.default_rng(self.uuid.int)
+        return OptimizationTask(
+            circuit_id=self.circuit_id,
+            num_qubits=self.num_qubits,
+            num_layers=self.num_layers,
+            initial_params=(
+                np.array(rng.random(rp_shape) * 2 * pi),
+                np.array(rng.random(crp_shape) * 4 * pi)
+            ),
+            max_evaluations=self.max_evaluations,
+            convergence_threshold=self.convergence_threshold,
+            shots=self.shots,
+        )
+
+    def __str__(self) -> str:
+        return f"{self.circuit_id}_{self.num_qubits}x{self.num_layers} (seed {self.seed})"
+
+def generate_tasks(
+    circuit_id: str,
+    num_qubits: int,
+    num_layers: int,
+    seeds: list[int],
+    max_evaluations: int = 250,
+    convergence_threshold: float = 1e-6,
+    shots: int = None,
+) -> list[OptimizationTask]:
+    return [
+        TaskKey(circuit_id, num_qubits, num_layers, seed, max_evaluations, convergence_threshold, shots).task()
+        for seed in seeds
+    ]
+
+def run_task(
+        task: OptimizationTask,
+        optimizers: list[tuple[str, Optimizer]],
+        uuid: UUID = None,
+) -> Instance:
+    print(f"Starting optimization for {task.circuit_id}_{task.num_qubits}x{task.num_layers}...")
+    results: dict[str, OptimizationResult] = {
+        name: optimize(task)
+        for name, optimize in optimizers
+    }
+
+    return Instance(
+        task=task,
+        results=results,
+        uuid=uuid,
+    )
+
+def _run_pair(key: TaskKey, optimizer_name: str) -> OptimizationResult:
+    """
+    Worker entry point: regenerates the task and runs one optimizer on it.
+    """
+    instance = run_task(key.task(), [(optimizer_name, dict(optimizers)[optimizer_name])])
+    return instance.results[optimizer_name]
+
+def _record_meta(key: TaskKey, optimizer_name: str, seconds: float) -> dict:
+    return {
+        "uuid": str(key.uuid),
+        "circuit_id": key.circuit_id,
+        "num_qubits": key.num_qubits,
+        "num_layers": key.num_layers,
+        "seed": key.seed,
+        "optimizer": optimizer_name,
+        "max_evaluations": key.max_evaluations,
+        "seconds": seconds,
+    }
+
+def _run_chunk(pairs: list[tuple[TaskKey, str]], log_folder: str) -> list[tuple[str, int, float]]:
+    """
+    Worker entry point: runs pairs one after the other and appends their
+    results to the worker's log segment. Returns the segment, offset and
+    duration of every pair.
+    """
+    writer = worker_writer(log_folder)
+    notices = []
+    for key, optimizer_name in pairs:
+        start = time.perf_counter()
+        result = _run_pair(key, optimizer_name)
+        seconds = time.perf_counter() - start
+        notices.append((writer.name, writer.append(_record_meta(key, optimizer_name, seconds), result), seconds))
+    return notices
+
+class Journal:
+    """
+    Append-only JSON lines file with one line per finished (task, optimizer)
+    pair. Lines of pairs whose loss curve is in the result log have no curve,
+    their `completed` entry is None.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.completed: dict[str, dict[str, OptimizationResult | None]] = {}
+        # (circuit_id, num_qubits, num_layers, optimizer, max_evaluations, shots, seconds) of the recorded runs
+        self.durations: list[tuple[str, int, int, str, int, int, float]] = []
+        if not os.path.exists(path):
+            return
+
+        with open(path, "r+") as file:
+            content = file.read()
+            # the last line of an interrupted run may be cut off, drop it so that new lines start cleanly
+            complete = content.rfind("\n") + 1
+            if complete < len(content):
+                file.truncate(len(content[:complete].encode()))
+
+        for line in content[:complete].splitlines():
+            entry = json.loads(line)
+            result = OptimizationResult(loss=zip(entry["evaluations"], entry["values"])) if "evaluations" in entry else None
+            self.completed.setdefault(entry["uuid"], {})[entry["optimizer"]] = result
+            if "seconds" in entry:
+                self.durations.append(self._duration(entry))
+
+    @staticmethod
+    def _duration(entry: dict) -> tuple[str, int, int, str, int, int, float]:
+        # lines written before shots were recorded are analytic runs
+        return (entry["circuit_id"], entry["num_qubits"], entry["num_layers"], entry["optimizer"], entry["max_evaluations"], entry.get("shots"), entry["seconds"])
+
+    def record(self, key: TaskKey, optimizer_name: str, result: OptimizationResult = None, seconds: float = None) -> None:
+        """
+        Without a `result`, the pair's loss curve is in the result log.
+        """
+        entry = {
+            "uuid": str(key.uuid),
+            "circuit_id": key.circuit_id,
+            "num_qubits": key.num_qubits,
+            "num_layers": key.num_layers,
+            "seed": key.seed,
+            "optimizer": optimizer_name,
+        }
+        if result is not None:
+            entry["evaluations"] = result.evaluations.tolist()
+            entry["values"] = result.values.tolist()
+        if seconds is not None:
+            entry["max_evaluations"] = key.max_evaluations
+            entry["shots"] = key.shots
+            entry["seconds"] = seconds
+            self.durations.append(self._duration(entry))
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.completed.setdefault(str(key.uuid), {})[optimizer_name] = result
+
+    def done(self, key: TaskKey, optimizer_name: str) -> bool:
+        return optimizer_name in self.completed.get(str(key.uuid), {})
+
+def task_keys(spec: dict) -> Iterator[TaskKey]:
+    """
+    Enumerates the tasks of a sweep spec. `seeds` is either a list of seeds or a number n for seeds 0..n-1.
+    If the spec has `shots`, the tasks are finite-shot tasks and their loss curves count shots.
+    """
+    seeds = spec["seeds"] if isinstance(spec["seeds"], list) else range(spec["seeds"])
+    for circuit_id in spec["circuits"]:
+        for num_qubits, num_layers in spec["sizes"]:
+            for seed in seeds:
+                yield TaskKey(
+                    circuit_id,
+                    num_qubits,
+                    num_layers,
+                    seed,
+                    spec.get("max_evaluations", 250),
+                    spec.get("convergence_threshold", 1e-6),
+                    spec.get("shots"),
+                )
+
+def _instance_path(folder: str, key: TaskKey) -> str:
+    return os.path.join(folder, f"{key.circuit_id}_{key.num_qubits}x{key.num_layers}_{key.uuid}.instance")
+
+def run_sweep(spec: dict, workers: int = None, max_in_flight: int = None, schedule: bool = True) -> None:
+    """
+    Runs all pairs of the sweep that are not in the journal yet, with at most
+    `max_in_flight` (default: twice the number of workers) chunks submitted at
+    a time. Without `schedule`, every pair is its own chunk, in spec order.
+    """
+    folder = spec["folder"]
+    optimizer_names = spec.get("optimizers", [name for name, _ in optimizers])
+    os.makedirs(folder, exist_ok=True)
+    journal = Journal(spec.get("journal", os.path.join(folder, ".journal.jsonl")))
+    log_folder = spec.get("log", os.path.join(folder, ".log"))
+    log = ResultLog(log_folder)
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+
+    def save_if_complete(key: TaskKey) -> bool:
+        # the instance file is the task's output, it is never overwritten
+        if os.path.exists(_instance_path(folder, key)):
+            return True
+        results = journal.completed.get(str(key.uuid), {})
+        if not all(name in results for name in optimizer_names):
+            return False
+        results = {name: results[name] if results[name] is not None else log.read(str(key.uuid), name) for name in optimizer_names}
+        Instance(task=key.task(), results=results, uuid=key.uuid).save(folder)
+        return True
+
+    # tasks that finished before the last run stopped, but were not saved
+    total = 0
+    pending = []
+    for key in task_keys(spec):
+        total += 1
+        if os.path.exists(_instance_path(folder, key)):
+            # the task was saved, even if the journal lost its lines
+            continue
+        uuid = str(key.uuid)
+        for name in optimizer_names:
+            if journal.done(key, name) and journal.completed[uuid][name] is None and (uuid, name) not in log:
+                # the record was lost or torn, run the pair again
+                print(f"No intact record of {key} {name} in the result log, running it again.")
+                del journal.completed[uuid][name]
+            elif not journal.done(key, name) and (uuid, name) in log:
+                # the worker wrote the record, but the run stopped before the journal line
+                journal.record(key, name, seconds=log.metadata[(uuid, name)]["seconds"])
+        if not save_if_complete(key):
+            pending.append(key)
+    print(f"{total - len(pending)}/{total} tasks already done, running {len(pending)} on {workers} workers.")
+
+    pairs = [
+        (key, name) for key in pending for name in optimizer_names
+        if not journal.done(key, name) and not os.path.exists(_instance_path(folder, key))
+    ]
+    if schedule:
+        model = CostModel()
+        model.calibrate(journal.durations)
+        costs = [model.predict(key.circuit_id, key.num_qubits, key.num_layers, name, key.max_evaluations, key.shots) for key, name in pairs]
+        chunks = affinity_chunks(pairs, costs, lambda pair: (pair[0].circuit_id, pair[0].num_qubits, pair[0].num_layers), workers)
+        cost_of = dict(zip(((key.uuid, name) for key, name in pairs), costs))
+        print(
+            f"{len(pairs)} pairs in {len(chunks)} chunks, predicted makespan {makespan([sum(cost_of[(key.uuid, name)] for key, name in chunk) for chunk in chunks], workers):.0f}s "
+            f"(in spec order: {makespan(costs, workers):.0f}s)."
+        )
+    else:
+        chunks = [[pair] for pair in pairs]
+
+    work = iter(chunks)
+    completed = total - len(pending)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight: dict[Future[list[tuple[str, int, float]]], list[tuple[TaskKey, str]]] = {}
+        while True:
+            while len(in_flight) < max_in_flight and (chunk := next(work, None)) is not None:
+                in_flight[executor.submit(_run_chunk, chunk, log_folder)] = chunk
+
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk = in_flight.pop(future)
+                for (key, name), (segment, offset, seconds) in zip(chunk, future.result()):
+                    log.add(segment, offset, _record_meta(key, name, seconds))
+                    journal.record(key, name, seconds=seconds)
+                    if save_if_complete(key):
+                        completed += 1
+                        print(f"[{completed}/{total}] {time.asctime()} - Completed {key} instance.")
+
+    # the workers are gone, so their segments can be merged
+    if len(log.segments()) > 1:
+        log.compact()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a sweep of optimization tasks, resuming where a previous run stopped.")
+    parser.add_argument("spec", help="JSON sweep spec, see sweeps/thesis.json")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="submitted chunks at a time (default: 2 per worker)")
+    parser.add_argument("--in-order", action="store_true", help="submit the pairs one by one in spec order instead of scheduling them")
+    args = parser.parse_args()
+
+    with open(args.spec, "r") as file:
+        spec = json.load(file)
+    run_sweep(spec, workers=args.workers, max_in_flight=args.max_in_flight, schedule=not args.in_order)
@@ -0,0 +1,117 @@
+"""
+Scheduling of the (task, optimizer) pairs of a sweep onto a worker pool.
+
+The run time of a pair is predicted by a cost model: one evaluation costs
+about (#parameters) x 2^(#qubits), i.e. gates times statevector size, and a
+run uses up to `max_evaluations` of them. With shots, an evaluation also
+draws that many samples. Gradient-based optimizers also pay one
+parameter-shift evaluation pair per parameter and step, hence one more
+factor of #parameters. The constant per optimizer is calibrated from the
+durations recorded in the journal of earlier runs, per circuit where there
+are enough observations.
+
+Pairs of the same circuit structure are grouped into chunks that a single
+worker runs one after the other, so it builds the circuit only once, and
+chunks are dispatched longest-first to keep the end of a sweep busy.
+"""
+import numpy as np
+from statistics import median
+
+from circuits import parameter_shapes
+
+# seconds per unit of work before calibration, and the power of #parameters in the work
+default_seconds_per_work = {
+    "Crotosolve": 1e-5,
+    "Rotosolve": 3e-5,
+    "Gradient Descent": 1e-5,
+    "Adam": 1e-5,
+    "Adagrad": 1e-5,
+}
+parameter_exponents = {
+    "Crotosolve": 1,
+    "Rotosolve": 1,
+    "Gradient Descent": 2,
+    "Adam": 2,
+    "Adagrad": 2,
+}
+# observations of a circuit needed before it gets its own constant
+min_circuit_observations = 3
+
+def work(circuit_id: str, num_qubits: int, num_layers: int, optimizer_name: str, max_evaluations: int = 250, shots: int = None) -> float:
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    num_params = max(int(np.prod(rp_shape)) + int(np.prod(crp_shape)), 1)
+    evaluation = num_params * 2 ** num_qubits + (shots or 0)
+    return num_params ** (parameter_exponents.get(optimizer_name, 1) - 1) * evaluation * max_evaluations
+
+class CostModel:
+    """
+    Predicts the seconds a (task, optimizer) pair takes, see the module docstring.
+    """
+    def __init__(self) -> None:
+        self.seconds_per_work = dict(default_seconds_per_work)
+        self.circuit_seconds_per_work: dict[tuple[str, str], float] = {}
+
+    def calibrate(self, observations: list[tuple[str, int, int, str, int, int, float]]) -> None:
+        """
+        Fits the constants to observed (circuit_id, num_qubits, num_layers,
+        optimizer_name, max_evaluations, shots, seconds) tuples: each constant
+        is the median ratio of observed seconds to work.
+        """
+        ratios: dict[str, list[float]] = {}
+        circuit_ratios: dict[tuple[str, str], list[float]] = {}
+        for circuit_id, num_qubits, num_layers, optimizer_name, max_evaluations, shots, seconds in observations:
+            ratio = seconds / work(circuit_id, num_qubits, num_layers, optimizer_name, max_evaluations, shots)
+            ratios.setdefault(optimizer_name, []).append(ratio)
+            circuit_ratios.setdefault((circuit_id, optimizer_name), []).append(ratio)
+
+        for optimizer_name, values in ratios.items():
+            self.seconds_per_work[optimizer_name] = median(values)
+        for key, values in circuit_ratios.items():
+            if len(values) >= min_circuit_observations:
+                self.circuit_seconds_per_work[key] = median(values)
+
+    def predict(self, circuit_id: str, num_qubits: int, num_layers: int, optimizer_name: str, max_evaluations: int = 250, shots: int = None) -> float:
+        seconds_per_work = self.circuit_seconds_per_work.get(
+            (circuit_id, optimizer_name),
+            self.seconds_per_work.get(optimizer_name, max(self.seconds_per_work.values())),
+        )
+        return seconds_per_work * work(circuit_id, num_qubits, num_layers, optimizer_name, max_evaluations, shots)
+
+def affinity_chunks(pairs: list, costs: list[float], structure_of, workers: int, chunks_per_worker: int = 4) -> list[list]:
+    """
+    Groups pairs by `structure_of(pair)` and splits every group into chunks of
+    at most 1/(chunks_per_worker * workers) of the total predicted cost (but
+    at least one pair), longest pairs first. Returns the chunks longest-first.
+    """
+    total = sum(costs)
+    limit = total / (chunks_per_worker * workers) if total > 0 else float("inf")
+
+    groups: dict[object, list[tuple[float, object]]] = {}
+    for pair, cost in zip(pairs, costs):
+        groups.setdefault(structure_of(pair), []).append((cost, pair))
+
+    chunks: list[tuple[float, list]] = []
+    for group in groups.values():
+        group.sort(key=lambda entry: entry[0], reverse=True)
+        chunk, chunk_cost = [], 0.0
+        for cost, pair in group:
+            if chunk and chunk_cost + cost > limit:
+                chunks.append((chunk_cost, chunk))
+                chunk, chunk_cost = [], 0.0
+            chunk.append(pair)
+            chunk_cost += cost
+        if chunk:
+            chunks.append((chunk_cost, chunk))
+
+    chunks.sort(key=lambda entry: entry[0], reverse=True)
+    return [chunk for _, chunk in chunks]
+
+def makespan(costs: list[float], workers: int) -> float:
+    """
+    The makespan of running jobs with the given costs in order on `workers`
+    workers that each take the next job when they are idle.
+    """
+    finish = np.zeros(workers)
+    for cost in costs:
+        finish[np.argmin(finish)] += cost
+    return float(finish.max())
@@ -0,0 +1,359 @@
+import pennylane as qml
+import numpy as np
+from numpy.typing import NDArray
+from pennylane import QNode
+from functools import lru_cache
+from typing import Callable
+
+from circuits import cached_circuit, parameter_shapes
+
+_paulis = {
+    "X": np.array([[0, 1], [1, 0]], dtype=complex),
+    "Y": np.array([[0, -1j], [1j, 0]], dtype=complex),
+    "Z": np.array([[1, 0], [0, -1]], dtype=complex),
+}
+
+# gate name -> Pauli generator of the (target) rotation
+rotation_generators = {
+    "RX": "X",
+    "RY": "Y",
+    "RZ": "Z",
+    "CRX": "X",
+    "CRY": "Y",
+    "CRZ": "Z",
+}
+
+def rotation_matrix(name: str, theta) -> NDArray[np.complex_]:
+    """
+    Matrix of the (controlled) rotation gate `name` for the angle(s) `theta`.
+    For an array of angles, a stack of matrices with shape (*theta.shape, d, d) is returned.
+    """
+    theta = np.asarray(theta, dtype=float)
+    cos = np.cos(theta / 2)[..., np.newaxis, np.newaxis]
+    sin = np.sin(theta / 2)[..., np.newaxis, np.newaxis]
+    rotation = cos * np.eye(2) - 1j * sin * _paulis[rotation_generators[name]]
+    if not name.startswith("C"):
+        return rotation
+
+    matrix = np.zeros(theta.shape + (4, 4), dtype=complex)
+    matrix[..., 0, 0] = matrix[..., 1, 1] = 1
+    matrix[..., 2:, 2:] = rotation
+    return matrix
+
+class Operation:
+    """
+    A single gate of a traced circuit. Parametrized gates refer to their
+    parameter by `gate` ("RP" or "CRP") and `param_index` into the
+    corresponding parameter array, fixed gates carry their `matrix`.
+    """
+    def __init__(
+            self,
+            name: str,
+            wires: list[int],
+            gate: str = None,
+            param_index: tuple = None,
+            matrix: NDArray[np.complex_] = None,
+            op_class: type = None,
+    ) -> None:
+        self.name = name
+        self.wires = wires
+        self.gate = gate
+        self.param_index = param_index
+        self.matrix = matrix
+        self.op_class = op_class
+
+    @property
+    def parametrized(self) -> bool:
+        return self.gate is not None
+
+    def matrix_at(self, theta) -> NDArray[np.complex_]:
+        if not self.parametrized:
+            return self.matrix
+        if self.name in rotation_generators:
+            return rotation_matrix(self.name, theta)
+        return np.asarray(self.op_class.compute_matrix(np.asarray(theta, dtype=float)))
+
+    def __repr__(self) -> str:
+        if self.parametrized:
+            return f"{self.name}({self.gate}{list(self.param_index)}, wires={self.wires})"
+        return f"{self.name}(wires={self.wires})"
+
+def extract_operations(
+        circuit: QNode,
+        rp_shape: tuple,
+        crp_shape: tuple,
+) -> tuple[int, list[Operation], NDArray[np.complex_]]:
+    """
+    Traces the circuit function of a `circuits.py` QNode once with marker
+    parameters (the flat index of every parameter) to find out which gate
+    uses which parameter.
+    Returns the number of qubits, the operations and the observable matrix.
+    """
+    rp_size = int(np.prod(rp_shape))
+    crp_size = int(np.prod(crp_shape))
+    rp_markers = np.arange(rp_size, dtype=float).reshape(rp_shape)
+    crp_markers = np.arange(rp_size, rp_size + crp_size, dtype=float).reshape(crp_shape)
+
+    with qml.tape.QuantumTape() as tape:
+        circuit.func(rp_markers, crp_markers)
+
+    wire_order = circuit.device.wires
+    operations = []
+    for op in tape.operations:
+        if op.name == "Barrier":
+            continue
+        wires = [wire_order.index(wire) for wire in op.wires]
+        if op.num_params == 0:
+            operations.append(Operation(op.name, wires, matrix=op.matrix(wire_order=op.wires), op_class=type(op)))
+            continue
+
+        assert op.num_params == 1, f"unsupported gate {op.name} with {op.num_params} parameters"
+        marker = int(op.data[0])
+        if marker < rp_size:
+            gate, param_index = "RP", np.unravel_index(marker, rp_shape)
+        else:
+            gate, param_index = "CRP", np.unravel_index(marker - rp_size, crp_shape)
+        param_index = tuple(int(i) for i in param_index)
+        operations.append(Operation(op.name, wires, gate=gate, param_index=param_index, op_class=type(op)))
+
+    assert len(tape.measurements) == 1, "only single expectation values are supported"
+    observable = qml.matrix(tape.measurements[0].obs, wire_order=wire_order)
+
+    return len(wire_order), operations, observable
+
+@lru_cache(maxsize=None)
+def cached_operations(circuit_id: str, num_qubits: int, num_layers: int) -> tuple[int, list[Operation], NDArray[np.complex_]]:
+    """
+    `extract_operations` for a circuit structure, traced once per process.
+    The result is shared and must not be modified.
+    """
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    return extract_operations(cached_circuit(circuit_id, num_qubits, num_layers), rp_shape, crp_shape)
+
+def _apply(tensor: NDArray, matrix: NDArray, axes: list[int], batched: bool = False) -> NDArray:
+    """
+    Applies `matrix` to the qubit `axes` of `tensor`. If `batched`, both the
+    tensor and the matrix have a leading batch axis.
+    """
+    num_axes = len(axes)
+    if batched:
+        moved = np.moveaxis(tensor, axes, range(1, 1 + num_axes))
+        shape = moved.shape
+        result = matrix @ moved.reshape(shape[0], 2 ** num_axes, -1)
+        return np.moveaxis(result.reshape(shape), range(1, 1 + num_axes), axes)
+
+    matrix = matrix.reshape((2,) * (2 * num_axes))
+    result = np.tensordot(matrix, tensor, axes=(range(num_axes, 2 * num_axes), axes))
+    return np.moveaxis(result, range(num_axes), axes)
+
+class StatevectorEngine:
+    """
+    Statevector simulator for the `circuits.py` ansatz family that is tailored
+    to coordinate-wise optimization.
+
+    The engine keeps a cursor at one gate together with the state right before
+    that gate and the observable back-propagated to right after it. Evaluating
+    the circuit for a new value of the gate's parameter then only needs one
+    gate application and an inner product. Moving the cursor to a neighbouring
+    gate updates both cached quantities with a single gate each.
+    """
+    def __init__(self, num_qubits: int, operations: list[Operation], observable: NDArray[np.complex_]) -> None:
+        self.num_qubits = num_qubits
+        self.operations = operations
+        self.observable = np.asarray(observable, dtype=complex)
+        self.evaluations = 0
+
+        self.positions: dict[tuple[str, tuple], list[int]] = {}
+        for position, operation in enumerate(operations):
+            if operation.parametrized:
+                self.positions.setdefault((operation.gate, operation.param_index), []).append(position)
+
+        self.rp_params = None
+        self.crp_params = None
+        self._cursor = None
+        self._state = None
+        self._suffix_observable = None
+
+    @staticmethod
+    def from_circuit(circuit: QNode, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> "StatevectorEngine":
+        engine = StatevectorEngine(*extract_operations(circuit, np.shape(rp_params), np.shape(crp_params)))
+        engine.load(rp_params, crp_params)
+        return engine
+
+    @staticmethod
+    def from_structure(circuit_id: str, num_qubits: int, num_layers: int, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> "StatevectorEngine":
+        """
+        Like `from_circuit`, but reuses the operations traced for the same circuit structure before.
+        """
+        engine = StatevectorEngine(*cached_operations(circuit_id, num_qubits, num_layers))
+        engine.load(rp_params, crp_params)
+        return engine
+
+    def load(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> None:
+        """
+        Sets the parameters all following evaluations refer to. Invalidates the cached environments.
+        """
+        self.rp_params = np.array(rp_params, dtype=float)
+        self.crp_params = np.array(crp_params, dtype=float)
+        self._cursor = None
+
+    def update(self, gate: str, param_index: tuple, value: float) -> None:
+        """
+        Changes a single parameter. The cached environments stay valid if the
+        parameter belongs to the gate at the cursor.
+        """
+        self._params(gate)[param_index] = value
+        if self.positions.get((gate, param_index), []) != [self._cursor]:
+            self._cursor = None
+
+    def __call__(self, rp_params: NDArray[np.float_], crp_params: NDArray[np.float_]) -> float:
+        """
+        Full simulation of the circuit for the given parameters (like the QNode).
+        """
+        self.evaluations += 1
+        state = self._zero_state()
+        for operation in self.operations:
+            theta = None
+            if operation.parametrized:
+                params = rp_params if operation.gate == "RP" else crp_params
+                theta = params[operation.param_index]
+            state = _apply(state, operation.matrix_at(theta), operation.wires)
+        return float(self._expval(state.reshape(1, -1), self.observable)[0])
+
+    def univariate(self, gate: str, param_index: tuple) -> Callable:
+        """
+        Returns the cost as a function of a single parameter (scalar or vector
+        of values), with all other parameters fixed to the loaded ones.
+        """
+        positions = self.positions.get((gate, param_index), [])
+        if len(positions) != 1:
+            # unused or shared parameter, no environment to cache
+            def univariate(param_values):
+                values = np.atleast_1d(np.asarray(param_values, dtype=float))
+                params = self._params(gate)
+                old_value = params[param_index]
+                results = []
+                for value in values:
+                    params[param_index] = value
+                    results.append(self(self.rp_params, self.crp_params))
+                params[param_index] = old_value
+                return results[0] if np.ndim(param_values) == 0 else np.array(results)
+
+            return univariate
+
+        self._move(positions[0])
+        operation = self.operations[positions[0]]
+
+        def univariate(param_values):
+            values = np.atleast_1d(np.asarray(param_values, dtype=float))
+            self.evaluations += len(values)
+            states = _apply(
+                np.broadcast_to(self._state, (len(values),) + self._state.shape[1:]),
+                operation.matrix_at(values),
+                [1 + wire for wire in operation.wires],
+                batched=True,
+            )
+            results = self._expval(states.reshape(len(values), -1), self._suffix_observable)
+            return float(results[0]) if np.ndim(param_values) == 0 else results
+
+        return univariate
+
+    def supports_coefficients(self, gate: str, param_index: tuple) -> bool:
+        positions = self.positions.get((gate, param_index), [])
+        return len(positions) == 0 or (len(positions) == 1 and self.operations[positions[0]].name in rotation_generators)
+
+    def fourier_coefficients(self, gate: str, param_index: tuple) -> tuple[float, float, float, float, float]:
+        """
+        Computes the coefficients of the univariate cost
+            f(x) = a0 + a_half cos(x/2) + b_half sin(x/2) + a1 cos(x) + b1 sin(x)
+        from the cached environment of the parameter's gate, without sampling.
+
+        A (controlled) rotation maps the state to v0 + cos(x/2) v1 + sin(x/2) v2 with
+        v0 = P0 psi, v1 = P1 psi and v2 = -i P1 G psi, where P0/P1 project the control
+        qubit (P0 = 0, P1 = 1 without control) and G is the Pauli generator. The
+        coefficients are then sums of the matrix elements M_jk = <v_j|O|v_k>.
+        """
+        positions = self.positions.get((gate, param_index), [])
+        if len(positions) == 0:
+            # parameter is not used by any gate, the cost is constant
+            return self(self.rp_params, self.crp_params), 0.0, 0.0, 0.0, 0.0
+        if not self.supports_coefficients(gate, param_index):
+            raise ValueError("no exact coefficients for parameter", gate, param_index)
+
+        self._move(positions[0])
+        operation = self.operations[positions[0]]
+        *controls, target = [1 + wire for wire in operation.wires]
+
+        v1 = self._state.copy()
+        v0 = np.zeros_like(v1)
+        for control in controls:
+            selector = [slice(None)] * v1.ndim
+            selector[control] = 0
+            v0[tuple(selector)] = v1[tuple(selector)]
+            v1[tuple(selector)] = 0
+        v2 = -1j * _apply(v1, _paulis[rotation_generators[operation.name]], [target])
+
+        vectors = np.stack([v.reshape(-1) for v in (v0, v1, v2)])
+        m = np.conj(vectors) @ self._suffix_observable @ vectors.T
+
+        return (
+            float(np.real(m[0, 0] + (m[1, 1] + m[2, 2]) / 2)),
+            float(2 * np.real(m[0, 1])),
+            float(2 * np.real(m[0, 2])),
+            float(np.real(m[1, 1] - m[2, 2]) / 2),
+            float(np.real(m[1, 2])),
+        )
+
+    def _params(self, gate: str) -> NDArray[np.float_]:
+        return self.rp_params if gate == "RP" else self.crp_params
+
+    def _matrix(self, position: int) -> NDArray[np.complex_]:
+        operation = self.operations[position]
+        if not operation.parametrized:
+            return operation.matrix
+        return operation.matrix_at(self._params(operation.gate)[operation.param_index])
+
+    def _zero_state(self) -> NDArray[np.complex_]:
+        state = np.zeros((2,) * self.num_qubits, dtype=complex)
+        state[(0,) * self.num_qubits] = 1
+        return state
+
+    @staticmethod
+    def _expval(states: NDArray[np.complex_], observable: NDArray[np.complex_]) -> NDArray[np.float_]:
+        return np.real(np.sum(np.conj(states) * (states @ observable.T), axis=1))
+
+    def _conjugate(self, observable: NDArray[np.complex_], matrix: NDArray[np.complex_], wires: list[int]) -> NDArray[np.complex_]:
+        """
+        Computes U O U^dagger for the gate U acting on `wires`.
+        """
+        dim = 2 ** self.num_qubits
+        shape = (2,) * self.num_qubits + (dim,)
+        left = _apply(observable.reshape(shape), matrix, wires).reshape(dim, dim)
+        return _apply(left.conj().T.reshape(shape), matrix, wires).reshape(dim, dim).conj().T
+
+    def _reset(self) -> None:
+        self._cursor = 0
+        self._state = self._zero_state()[np.newaxis]
+        self._suffix_observable = self.observable
+        for position in range(len(self.operations) - 1, 0, -1):
+            matrix = self._matrix(position)
+            self._suffix_observable = self._conjugate(self._suffix_observable, matrix.conj().T, self.operations[position].wires)
+
+    def _move(self, position: int) -> None:
+        if self._cursor is None:
+            self._reset()
+
+        while self._cursor < position:
+            # state passes the gate at the cursor, the next gate leaves the suffix
+            operation = self.operations[self._cursor]
+            self._state = _apply(self._state, self._matrix(self._cursor), [1 + wire for wire in operation.wires])
+            self._cursor += 1
+            self._suffix_observable = self._conjugate(self._suffix_observable, self._matrix(self._cursor), self.operations[self._cursor].wires)
+
+        while self._cursor > position:
+            # the gate at the cursor joins the suffix, the previous gate is undone on the state
+            operation = self.operations[self._cursor]
+            self._suffix_observable = self._conjugate(self._suffix_observable, self._matrix(self._cursor).conj().T, operation.wires)
+            self._cursor -= 1
+            previous = self.operations[self._cursor]
+            self._state = _apply(self._state, self._matrix(self._cursor).conj().T, [1 + wire for wire in previous.wires])
@@ -0,0 +1,120 @@
+"""
+Structural analysis of the `circuits.py` ansatz family.
+
+Two parameters a and b can be updated together by Crotosolve if the cost is
+additively separable in them, f = g(a, rest) + h(b, rest), because then the
+minimum over b does not depend on a. This holds iff the mixed difference
+    f(a+s, b+s) - f(a+s, b-s) - f(a-s, b+s) + f(a-s, b-s)
+vanishes everywhere, which is checked at a few random parameter points.
+
+The frequency spectrum of each parameter (which frequencies it contributes
+to the cost) is derived from the generators of the gates it appears in.
+"""
+import inspect
+import pennylane as qml
+import numpy as np
+from functools import lru_cache
+from numpy.typing import NDArray
+from typing import Callable
+
+from circuits import cached_circuit, parameter_shapes
+from reconstruction import Spectrum
+from statevector import StatevectorEngine, cached_operations
+
+# nonzero for all frequencies (1/2 and 1) that rotation parameters have in the cost
+shift = np.pi / 2
+
+def _mixed_difference(
+        evaluate: Callable,
+        rp_params: NDArray[np.float_],
+        crp_params: NDArray[np.float_],
+        a: tuple[str, tuple],
+        b: tuple[str, tuple],
+) -> float:
+    difference = 0.0
+    for sign_a, sign_b, factor in [(1, 1, 1), (1, -1, -1), (-1, 1, -1), (-1, -1, 1)]:
+        params = {"RP": rp_params.copy(), "CRP": crp_params.copy()}
+        params[a[0]][a[1]] += sign_a * shift
+        params[b[0]][b[1]] += sign_b * shift
+        difference += factor * evaluate(params["RP"], params["CRP"])
+    return difference
+
+def separable(
+        evaluate: Callable,
+        points: list[tuple[NDArray[np.float_], NDArray[np.float_]]],
+        a: tuple[str, tuple],
+        b: tuple[str, tuple],
+        tolerance: float = 1e-9,
+) -> bool:
+    """
+    Whether the cost is additively separable in the parameters `a` and `b`
+    (each a (gate, param_index) pair), tested at the given parameter points.
+    """
+    return all(
+        abs(_mixed_difference(evaluate, rp_params, crp_params, a, b)) <= tolerance
+        for rp_params, crp_params in points
+    )
+
+def block_groups(
+        evaluate: Callable,
+        rp_shape: tuple,
+        crp_shape: tuple,
+        num_points: int = 3,
+        seed: int = 0,
+) -> dict[str, list[list[tuple]]]:
+    """
+    Splits the parameters of each gate type into groups of consecutive
+    parameters (in sweep order) that are pairwise separable, so updating a
+    group at once gives the same result as updating its members one by one.
+    Returns the groups of parameter indices per gate type.
+    """
+    rng = np.random.default_rng(seed)
+    points = [
+        (rng.random(rp_shape) * 2 * np.pi, rng.random(crp_shape) * 4 * np.pi)
+        for _ in range(num_points)
+    ]
+
+    groups = {}
+    for gate, shape in [("RP", rp_shape), ("CRP", crp_shape)]:
+        groups[gate] = []
+        for param_index in np.ndindex(shape):
+            group = groups[gate][-1] if groups[gate] else None
+            if group is not None and all(separable(evaluate, points, (gate, member), (gate, param_index)) for member in group):
+                group.append(param_index)
+            else:
+                groups[gate].append([param_index])
+    return groups
+
+@lru_cache(maxsize=None)
+def cached_block_groups(circuit_id: str, num_qubits: int, num_layers: int) -> dict[str, list[list[tuple]]]:
+    """
+    `block_groups` of a circuit structure, computed once per process with a `StatevectorEngine`.
+    """
+    engine = StatevectorEngine(*cached_operations(circuit_id, num_qubits, num_layers))
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    return block_groups(engine, rp_shape, crp_shape)
+
+def parameter_spectra(circuit: qml.QNode, rp_shape: tuple, crp_shape: tuple) -> dict[tuple[str, tuple], Spectrum]:
+    """
+    The positive frequencies of every parameter, keyed by (gate, param_index).
+    A parameter that is used by several gates has the sums of their
+    frequencies, e.g. (1, 2) for two RY gates; an unused one gets ().
+    """
+    spectra = qml.fourier.qnode_spectrum(circuit)(
+        qml.numpy.zeros(rp_shape, requires_grad=True),
+        qml.numpy.zeros(crp_shape, requires_grad=True),
+    )
+    rp_arg, crp_arg = list(inspect.signature(circuit.func).parameters)[:2]
+    return {
+        (gate, param_index): tuple(float(frequency) for frequency in spectra.get(arg, {}).get(param_index, []) if frequency > 0)
+        for gate, arg, shape in [("RP", rp_arg, rp_shape), ("CRP", crp_arg, crp_shape)]
+        for param_index in np.ndindex(shape)
+    }
+
+@lru_cache(maxsize=None)
+def cached_parameter_spectra(circuit_id: str, num_qubits: int, num_layers: int) -> dict[tuple[str, tuple], Spectrum]:
+    """
+    `parameter_spectra` of a circuit structure, computed once per process.
+    """
+    rp_shape, crp_shape = parameter_shapes(circuit_id, num_qubits, num_layers)
+    return parameter_spectra(cached_circuit(circuit_id, num_qubits, num_layers), rp_shape, crp_shape)